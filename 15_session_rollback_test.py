@@ -0,0 +1,61 @@
+# Checks that a CZ session is one transaction, rolled back as a whole when an
+# error is raised inside it. Runs on SQLite with pytest:
+#     python -m pytest 15_session_rollback_test.py
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+import pleiades as ple
+
+
+@pytest.fixture
+def cz(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    cz = ple.CZ(engine)
+    yield cz
+    engine.dispose()
+
+
+def write_csv(path):
+    pd.DataFrame({'id': [1, 2, 3], 'name': ['kazuma', 'aqua', 'megumin']}).to_csv(path, index=False)
+    return str(path)
+
+
+def count(cz, table):
+    return len(cz.select_from(table).ex())
+
+
+def test_session_rolls_back_inserts(cz, tmp_path):
+    file = write_csv(tmp_path / 'konosuba.csv')
+    cz.csv_table(file, 'konosuba', pkey='id')
+    # csv_insert wraps its insert in a SAVEPOINT, which must not commit the
+    # session early.
+    with pytest.raises(RuntimeError):
+        with cz.session():
+            cz.csv_insert(file, 'konosuba')
+            raise RuntimeError
+    assert count(cz, 'konosuba') == 0
+
+
+def test_session_commits_inserts(cz, tmp_path):
+    file = write_csv(tmp_path / 'konosuba.csv')
+    cz.csv_table(file, 'konosuba', pkey='id')
+    with cz.session():
+        cz.csv_insert(file, 'konosuba')
+        # Duplicates fall back to row by row inserts inside the session.
+        cz.csv_insert(file, 'konosuba')
+    assert count(cz, 'konosuba') == 3
+
+
+def test_failed_file_leaves_no_rows(cz, tmp_path):
+    file = write_csv(tmp_path / 'konosuba.csv')
+    cz.csv_table(file, 'konosuba', pkey='id')
+
+    # Fails after its rows are inserted, as a file that breaks partway would.
+    def insert(cz, source, target, pkey):
+        cz.csv_insert(source, target)
+        raise ValueError('bad file')
+
+    # csvs_into_database and s3_insert load each file in its own session.
+    records = cz._load_groups({'konosuba': [(file, 'id')]}, insert)
+    assert records[0]['status'] == 'failed'
+    assert count(cz, 'konosuba') == 0
@@ -0,0 +1,57 @@
+# Checks that iter_keys and get_keys page through bucket listings, filter
+# keys and list "directories". Runs against a mock S3 with pytest and moto:
+#     python -m pytest 16_s3_keys_test.py
+import os
+import boto3
+import pytest
+from moto import mock_aws
+import pleiades as ple
+
+bucket_name = 'testbucket'
+
+
+@pytest.fixture
+def s3():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=bucket_name)
+        yield s3
+
+
+def put(s3, *keys):
+    for key in keys:
+        s3.meta.client.put_object(Bucket=bucket_name, Key=key, Body=b'')
+
+
+def test_pages_past_1000_keys(s3):
+    keys = [f'data/{i:04d}.csv' for i in range(2500)]
+    put(s3, *keys)
+    cz = ple.CZ(s3)
+    # S3 returns at most 1000 keys a page.
+    assert cz.get_keys(bucket_name, prefix='data/') == keys
+    first = next(cz.iter_keys(bucket_name, prefix='data/'))
+    assert first == 'data/0000.csv'
+
+
+def test_suffix_regex(s3):
+    put(s3, 'data/a.csv', 'data/b.csv.gz', 'data/c.txt', 'data/csv.txt')
+    cz = ple.CZ(s3)
+    assert cz.get_keys(bucket_name, prefix='data/', suffix=r'\.csv$') == ['data/a.csv']
+    assert cz.get_keys(bucket_name, prefix='data/', suffix=r'\.csv(\.gz)?$') == ['data/a.csv', 'data/b.csv.gz']
+
+
+def test_skips_folder_placeholders(s3):
+    # Consoles make empty keys ending in / to show folders.
+    put(s3, 'data/', 'data/sub/', 'data/a.csv', 'data/sub/b.csv')
+    cz = ple.CZ(s3)
+    assert cz.get_keys(bucket_name, prefix='data/') == ['data/a.csv', 'data/sub/b.csv']
+    # A leading delimiter on the prefix is ignored.
+    assert cz.get_keys(bucket_name, prefix='/data/sub/') == ['data/sub/b.csv']
+
+
+def test_dirs(s3):
+    put(s3, 'data/a.csv', 'data/2020/b.csv', 'data/2021/c.csv', 'data/2021/d/e.csv', 'other/f.csv')
+    cz = ple.CZ(s3)
+    assert cz.get_keys(bucket_name, prefix='data/', dirs=True) == ['data/2020/', 'data/2021/']
+    assert cz.get_keys(bucket_name, prefix='', dirs=True) == ['data/', 'other/']
@@ -0,0 +1,75 @@
+# Checks that download_files skips keys whose local copy is unchanged, for
+# objects uploaded in one part and in several. Runs against a mock S3 with
+# pytest and moto:
+#     python -m pytest 16a_s3_download_test.py
+import os
+import boto3
+import pytest
+from boto3.s3.transfer import TransferConfig
+from moto import mock_aws
+import pleiades as ple
+
+bucket_name = 'testbucket'
+MB = 1048576
+
+
+@pytest.fixture
+def s3():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=bucket_name)
+        yield s3
+
+
+def upload(s3, key, size, folder, part_size=8 * MB):
+    # Each MB differs so parts in the wrong place change the ETag.
+    body = b''.join(bytes([i % 251]) * MB for i in range(size // MB)) + b'x' * (size % MB)
+    path = folder / f'upload_{key}'
+    with open(path, 'wb') as f:
+        f.write(body)
+    config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size)
+    s3.meta.client.upload_file(str(path), bucket_name, key, Config=config)
+    os.remove(path)
+
+
+def statuses(df):
+    return dict(zip(df['key'], df['status']))
+
+
+def test_single_part_skip(s3, tmp_path):
+    upload(s3, 'small.csv', 1000, tmp_path)
+    cz = ple.CZ(s3)
+    savein = f'{tmp_path}/'
+    assert statuses(cz.download_files(bucket_name, 'small.csv', savein=savein)) == {'small.csv': 'downloaded'}
+    assert statuses(cz.download_files(bucket_name, 'small.csv', savein=savein)) == {'small.csv': 'skipped'}
+    # A local copy of the same size but other content is downloaded again.
+    with open(tmp_path / 'small.csv', 'r+b') as f:
+        f.write(b'y')
+    assert statuses(cz.download_files(bucket_name, 'small.csv', savein=savein)) == {'small.csv': 'downloaded'}
+
+
+def test_multipart_skip(s3, tmp_path):
+    # 20MB in 8MB parts, as boto3 uploads by default.
+    upload(s3, 'big.csv', 20 * MB, tmp_path)
+    etag = s3.meta.client.head_object(Bucket=bucket_name, Key='big.csv')['ETag']
+    assert etag.endswith('-3"')
+    cz = ple.CZ(s3)
+    savein = f'{tmp_path}/'
+    assert statuses(cz.download_files(bucket_name, 'big.csv', savein=savein)) == {'big.csv': 'downloaded'}
+    assert statuses(cz.download_files(bucket_name, 'big.csv', savein=savein)) == {'big.csv': 'skipped'}
+    # 8MB is tried even when downloading with another chunksize.
+    assert statuses(cz.download_files(bucket_name, 'big.csv', savein=savein, chunksize=5 * MB)) == {'big.csv': 'skipped'}
+    with open(tmp_path / 'big.csv', 'r+b') as f:
+        f.seek(19 * MB)
+        f.write(b'y')
+    assert statuses(cz.download_files(bucket_name, 'big.csv', savein=savein)) == {'big.csv': 'downloaded'}
+
+
+def test_multipart_skip_with_chunksize(s3, tmp_path):
+    # Uploaded in 5MB parts, found through the chunksize argument.
+    upload(s3, 'parts.csv', 12 * MB, tmp_path, part_size=5 * MB)
+    cz = ple.CZ(s3)
+    savein = f'{tmp_path}/'
+    assert statuses(cz.download_files(bucket_name, 'parts.csv', savein=savein, chunksize=5 * MB)) == {'parts.csv': 'downloaded'}
+    assert statuses(cz.download_files(bucket_name, 'parts.csv', savein=savein, chunksize=5 * MB)) == {'parts.csv': 'skipped'}
@@ -0,0 +1,66 @@
+# Checks that AsyncCZ methods which write to the database actually run when
+# awaited. Runs on SQLite through aiosqlite with pytest:
+#     python -m pytest 17_async_test.py
+import asyncio
+import pandas as pd
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+import pleiades as ple
+
+
+@pytest.fixture
+def acz(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    yield ple.AsyncCZ(engine)
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / 'konosuba.csv'
+    pd.DataFrame({
+        'id': [1, 2, 3],
+        'name': ['kazuma', 'aqua', 'megumin'],
+        'age': [17, 18, 14],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_round_trip(acz, file):
+    async def run():
+        assert await acz.csv_table(file, 'konosuba', pkey='id') == 'table konosuba created.'
+        await acz.csv_insert(file, 'konosuba')
+        df = await acz.select_from('konosuba').ex()
+        assert df.sort_values('id')['name'].tolist() == ['kazuma', 'aqua', 'megumin']
+
+        await acz.clone_table('konosuba', where='id = 1')
+        await acz.insert_columns('konosuba_copy', 'konosuba', where='id > 1')
+        assert len(await acz.select_from('konosuba_copy').ex()) == 3
+
+        await acz.del_columns('konosuba_copy', 'age', if_exists=False)
+        columns = await acz.select_from('konosuba_copy').ex()
+        assert list(columns.columns) == ['id', 'name']
+
+    asyncio.run(run())
+
+
+def test_statements_reach_the_database(acz, file):
+    async def run():
+        await acz.csv_table(file, 'konosuba')
+        assert await acz.del_tables('konosuba', printable=True) == 'DROP TABLES konosuba;'
+        # DROP TABLES is MariaDB syntax, so SQLite rejects it. What matters
+        # is that it was sent rather than reported done unawaited.
+        with pytest.raises(OperationalError):
+            await acz.del_tables('konosuba')
+        tables = await acz._read("SELECT name FROM sqlite_master WHERE type = 'table';")
+        assert tables['name'].tolist() == ['konosuba']
+
+    asyncio.run(run())
+
+
+def test_sync_only_methods_raise(acz, file):
+    with pytest.raises(NotImplementedError):
+        acz.csvs_into_database(file)
+    with pytest.raises(NotImplementedError):
+        acz.session()
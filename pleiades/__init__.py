@@ -1,4 +1,4 @@
-from .cz import CZ
+from .cz import AsyncCZ, CZ
 from .lupu import Lupu
 from .nabe import Nabe
 from .sebastian import Sebastian
@@ -1,79 +1,1279 @@
 # CZ deals with databases.
 # She primarily functions to make the use of sqlalchemy easier.
 # She pastes 1 yen stickers on things she likes.
+from contextlib import contextmanager
 
 
 class CZ:
 
-    def __init__(self, engine=None, database=None):
+    def __init__(self, engine=None, database=None, cache=None, catalog=False):
         self.engine = engine
         self.database = database
+        # Optional CZ.Cache of query results.
+        self.cache = cache
+        # Optional CZ.Catalog of schema metadata.
+        self.catalog = self.Catalog() if catalog is True else catalog or None
+        # Connection shared by every method while a session is open.
+        self._con = None
+        # Number of pool checkouts and total and longest wait for them.
+        self._waits = [0, 0.0, 0.0]
         self.dtype_dic = {
             'int64': 'INT',
             'float64': 'DOUBLE',
             'bool': 'BOOLEAN',
             'datetime64': 'DATETIME'
         }
+        self.compression_dic = {
+            '.gz': 'gzip',
+            '.bz2': 'bz2',
+            '.zst': 'zstd',
+            '.xz': 'xz'
+        }
         self.tabspace = 4
+        self.inference_report = None
+        self.load_stats = None
+
+    # This function is meant to be used on boto3.resource objects.
+    def get_keys(self, bucket_name, prefix='/', suffix=None, delimiter='/', dirs=False):
+        return list(self.iter_keys(bucket_name, prefix=prefix, suffix=suffix, delimiter=delimiter, dirs=dirs))
 
     # This function is meant to be used on boto3.resource objects.
-    def get_keys(self, bucket_name, prefix='/', suffix=None, delimiter='/'):
+    def iter_keys(self, bucket_name, prefix='/', suffix=None, delimiter='/', dirs=False):
+        '''
+        Yields the keys under prefix in a bucket one page of results at a
+        time, so the listing is never held in memory as a whole. Folder
+        placeholder keys, which end in the delimiter, are left out.
+        params:
+            bucket_name the bucket to list.
+            prefix      only keys starting with prefix are listed. A leading
+                        delimiter is ignored.
+            suffix      regex pattern keys must contain, such as r'\\.csv$'.
+            delimiter   the character that separates "directories" in keys.
+            dirs        if True, the "directories" directly under prefix are
+                        listed instead of keys, as the common prefixes S3
+                        returns for the delimiter.
+        '''
         import re
         prefix = prefix[1:] if prefix.startswith(delimiter) else prefix
-        bucket = self.engine.Bucket(bucket_name)
-        keys = [_.key for _ in bucket.objects.filter(Prefix=prefix)]
-        for key in keys:
-            if suffix:
-                if not re.search(suffix, key):
-                    keys.remove(key)
-            if key[-1:] == delimiter:
-                keys.remove(key)
-        return keys
+        pattern = re.compile(suffix) if suffix else None
+        paginator = self.engine.meta.client.get_paginator('list_objects_v2')
+        params = {'Bucket': bucket_name, 'Prefix': prefix}
+        if dirs:
+            params['Delimiter'] = delimiter
+        for page in paginator.paginate(**params):
+            if dirs:
+                keys = (p['Prefix'] for p in page.get('CommonPrefixes', []))
+            else:
+                keys = (c['Key'] for c in page.get('Contents', [])
+                        if not c['Key'].endswith(delimiter))
+            for key in keys:
+                if pattern is None or pattern.search(key):
+                    yield key
 
     # This function is meant to be used on boto3.resource objects.
-    def download_files(self, bucket_name, keys, savein=''):
-        import re
+    def download_files(self, bucket_name, keys, savein='', workers=8, chunksize=8388608, max_concurrency=10, retries=3, skip_unchanged=True):
+        '''
+        Downloads keys from a bucket, several at a time. Returns a DataFrame
+        reporting the status, bytes, seconds and MB/s of each key.
+        params:
+            bucket_name the bucket to download from.
+            keys        key or list of keys to download. Each is saved as
+                        savein + the last part of the key.
+            savein      prefix of the path files are saved to, such as
+                        'folder/'.
+            workers     the number of keys downloaded at once.
+            chunksize   size in bytes of the parts large files are
+                        downloaded in, and the size past which they are.
+            max_concurrency the number of threads downloading the parts of
+                        each file.
+            retries     the number of times a failed download is retried,
+                        waiting twice as long each time.
+            skip_unchanged  if True, keys whose file already exists with the
+                        same size and ETag are skipped.
+        '''
+        import time
+        import pandas as pd
+        from boto3.s3.transfer import TransferConfig
+        from botocore.exceptions import ClientError
+        from concurrent.futures import ThreadPoolExecutor
         if isinstance(keys, str):
             keys = [keys]
-        for key in keys:
-            filename = re.search(r'/([^/]+)$', key, re.I)[1]
-            file_path = savein + filename
-            bucket = self.engine.Bucket(bucket_name)
-            bucket.download_file(key, file_path)
-        return f'{len(keys)} files downloaded.'
+        # Clients are thread safe where resources aren't, so one is shared.
+        client = self.engine.meta.client
+        config = TransferConfig(multipart_threshold=chunksize, multipart_chunksize=chunksize,
+                                max_concurrency=max_concurrency)
+
+        def download(key):
+            file_path = savein + key.rsplit('/', 1)[-1]
+            record = {'key': key, 'file': file_path, 'bytes': 0}
+            start = time.perf_counter()
+            for attempt in range(retries + 1):
+                try:
+                    head = client.head_object(Bucket=bucket_name, Key=key)
+                    record['bytes'] = head['ContentLength']
+                    if skip_unchanged and self._unchanged(file_path, head, (chunksize,)):
+                        record['status'] = 'skipped'
+                        break
+                    client.download_file(bucket_name, key, file_path, Config=config)
+                    record['status'] = 'downloaded'
+                    break
+                except ClientError as err:
+                    # Missing keys and denied access won't change on a retry.
+                    code = err.response.get('Error', {}).get('Code')
+                    if code in ('404', '403', 'NoSuchKey', 'AccessDenied') or attempt == retries:
+                        record['status'] = 'failed'
+                        record['message'] = str(err)
+                        break
+                except Exception as err:
+                    if attempt == retries:
+                        record['status'] = 'failed'
+                        record['message'] = str(err)
+                        break
+                time.sleep(0.5 * 2 ** attempt)
+            record['seconds'] = time.perf_counter() - start
+            downloaded = record['bytes'] if record['status'] == 'downloaded' else 0
+            record['mbps'] = downloaded / 1048576 / record['seconds'] if record['seconds'] else 0.0
+            return record
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            records = list(executor.map(download, keys))
+        columns = ['key', 'file', 'status', 'bytes', 'seconds', 'mbps', 'message']
+        return pd.DataFrame(records, columns=columns)
+
+    def _unchanged(self, file_path, head, part_sizes=()):
+        '''
+        Returns True if the file at file_path has the size and ETag given by
+        head_object. Multipart ETags are the MD5 of each part's MD5, so the
+        part size the object was uploaded with has to be found. part_sizes
+        are tried first, then boto3's default of 8MB, then the size divided
+        by the number of parts rounded up to a whole MB. Only sizes that
+        give the ETag's number of parts are hashed.
+        '''
+        import hashlib
+        import math
+        import os
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != head['ContentLength']:
+            return False
+        etag = head.get('ETag', '').strip('"')
+        size = head['ContentLength']
+        parts = int(etag.split('-')[1]) if '-' in etag else 0
+        if parts:
+            guess = math.ceil(size / parts / 1048576) * 1048576
+            candidates = [p for p in (*part_sizes, 8388608, guess) if p and math.ceil(size / p) == parts]
+        else:
+            candidates = [size]
+        for part_size in dict.fromkeys(candidates):
+            digests = []
+            with open(file_path, 'rb') as f:
+                for _ in range(max(parts, 1)):
+                    md5 = hashlib.md5()
+                    left = part_size
+                    while left > 0:
+                        block = f.read(min(left, 1048576))
+                        if not block:
+                            break
+                        md5.update(block)
+                        left -= len(block)
+                    digests.append(md5)
+            if not parts:
+                return digests[0].hexdigest() == etag
+            combined = hashlib.md5(b''.join(d.digest() for d in digests))
+            if f'{combined.hexdigest()}-{parts}' == etag:
+                return True
+        return False
 
     class SQL:
         '''
         The SQL object allows a SQL statement to be extended with methods like
-        where() before being executed with .ex()
+        where(), join(), group_by(), having(), order_by(), limit() and union()
+        before being executed with .ex(). Statements started by select_from
+        are kept as a tree of clauses and rendered for the engine's dialect.
+        The rendered statement is cached by the shape of the tree, so the
+        same query with another limit or offset is not built again. Those
+        values are sent as bound parameters, so the server sees the same
+        statement text each time and can reuse its plan. A SQL object made
+        from a command string runs it as is.
         '''
 
-        def __init__(self, command, engine=None, tabspace=4):
-            self.command = command
+        # (dialect, shape): text() statement, shared by every SQL object.
+        _templates = {}
+
+        def __init__(self, command=None, engine=None, tabspace=4, cache=None, database=None, table=None, cols=None, connection=None):
             self.engine = engine
+            # Opens the connection reads run on, such as CZ._connection, so
+            # they see the CZ's open session.
+            self.connection = connection
             self.tabspace = tabspace
+            self.cache = cache
+            self.database = database
+            self.params = {}
+            self._command = command
+            self._unions = []
+            self.tree = None
+            if table is not None:
+                if isinstance(cols, list):
+                    cols = tuple(cols)
+                self.tree = {
+                    'cols': cols,
+                    'table': table,
+                    'joins': (),
+                    'where': (),
+                    'group_by': (),
+                    'having': (),
+                    'unions': (),
+                    'order_by': (),
+                    'limit': False,
+                    'offset': False,
+                }
+
+        @property
+        def command(self):
+            # The statement with its parameters written in, for printing.
+            if self.tree is None:
+                return self._literal(self._command, self.params)
+            statement, params = self.compile()
+            return self._literal(statement.text, params)
+
+        @command.setter
+        def command(self, command):
+            self._command = command
+            self.tree = None
 
         def ex(self, p=False):
-            command = self.command
             if p or self.engine is None:
-                return command
+                return self.command
             import pandas as pd
-            df = pd.read_sql_query(command, self.engine)
+            statement, params = self._statement()
+            key = getattr(statement, 'text', statement)
+            if self.cache is not None:
+                df = self.cache.get(key, self.database, params)
+                if df is not None:
+                    return df
+            with self._connect() as con:
+                df = pd.read_sql_query(statement, con, params=params)
+            if self.cache is not None:
+                self.cache.put(key, df, self.database, params)
             return df
 
-        def where(self, condition):
-            command = self.command
-            command = command[:-1] + f'WHERE {condition}\n;'
-            self.command = command
+        def _connect(self):
+            if self.connection is not None:
+                return self.connection()
+            return self.engine.connect()
+
+        def where(self, condition, **params):
+            '''
+            Adds a condition. Values are best passed as bound parameters,
+            named in the condition with a colon, which are sent apart from
+            the statement and so are never read as SQL:
+                sql.where('age > :age', age=30)
+            A list or tuple binds each of its values, as in
+            where('id IN :ids', ids=[1, 2, 3]).
+            '''
+            self._bind(params)
+            if self.tree is None:
+                self._command = self._command[:-1] + f'WHERE {condition}\n;'
+                return self
+            return self._add('where', condition)
+
+        def join(self, table, on=None, how='INNER', **params):
+            '''
+            Joins table, which may be given with an alias such as 'quest q',
+            on condition on. how is INNER, LEFT, RIGHT, FULL or CROSS. Values
+            in on are bound as in where().
+            '''
+            self._tree()
+            self._bind(params)
+            name = table.split()[0]
+            if self.database and '.' not in name:
+                table = self.database + '.' + table
+            return self._add('joins', (how.upper(), table, on))
+
+        def group_by(self, cols):
+            if isinstance(cols, str):
+                cols = [cols]
+            return self._add('group_by', *cols)
+
+        def having(self, condition, **params):
+            # Values in condition are bound as in where().
+            self._tree()
+            self._bind(params)
+            return self._add('having', condition)
+
+        def order_by(self, cols, desc=False):
+            '''
+            Orders the results by cols, descending if desc. Columns can also
+            carry their own ASC or DESC, such as 'age DESC'. With union(), the
+            order applies to the combined results.
+            '''
+            if isinstance(cols, str):
+                cols = [cols]
+            if desc:
+                cols = [f'{col} DESC' for col in cols]
+            return self._add('order_by', *cols)
+
+        def limit(self, rows, offset=None):
+            '''
+            Returns at most rows rows, after skipping offset rows. Both are
+            bound parameters, so changing them reuses the same statement.
+            '''
+            self._tree()['limit'] = True
+            self.params['_limit'] = int(rows)
+            if offset is not None:
+                self.tree['offset'] = True
+                self.params['_offset'] = int(offset)
+            return self
+
+        def union(self, other, all=False):
+            '''
+            Combines the results with those of another SQL object started by
+            select_from. Duplicate rows are removed unless all. If other has
+            its own order_by or limit, it is combined as a subquery so they
+            apply to its rows alone.
+            '''
+            if other.tree is None:
+                raise ValueError('only statements started by select_from can be combined.')
+            self._unions.append(other)
+            return self._add('unions', (bool(all), other.shape()))
+
+        def _bind(self, params):
+            # Adds bound values. A name already bound to another value is
+            # refused, as every condition using it would get the new one.
+            for name, value in params.items():
+                if name in self.params and self.params[name] != value:
+                    raise ValueError(f':{name} is already bound to {self.params[name]!r}, use another name for {value!r}.')
+            self.params.update(params)
+
+        def _tree(self):
+            if self.tree is None:
+                raise ValueError('only statements started by select_from can be extended this way.')
+            return self.tree
+
+        def _add(self, clause, *items):
+            tree = self._tree()
+            tree[clause] = tree[clause] + items
             return self
 
+        def shape(self):
+            '''
+            Returns a hashable description of the statement's clauses,
+            without its parameter values.
+            '''
+            return tuple(self._tree().items())
+
+        def compile(self, dialect=None):
+            '''
+            Returns the statement as a sqlalchemy text() clause for dialect,
+            the engine's by default, and the parameters to bind to it. The
+            clause is made once per shape and dialect and reused after.
+            '''
+            if dialect is None and self.engine is not None:
+                dialect = self.engine.dialect.name
+            params = self._params()
+            expanding = self._expanding(params)
+            key = (dialect, self.shape(), expanding)
+            statement = CZ.SQL._templates.get(key)
+            if statement is None:
+                statement = self._text(self._render(dialect) + ';', expanding)
+                if len(CZ.SQL._templates) >= 1024:
+                    # The oldest template makes room for the new one.
+                    CZ.SQL._templates.pop(next(iter(CZ.SQL._templates)))
+                CZ.SQL._templates[key] = statement
+            return statement, params
+
+        def _statement(self):
+            # Returns what is handed to the driver and its parameters.
+            if self.tree is None:
+                if not self.params:
+                    return self._command, None
+                return self._text(self._command, self._expanding(self.params)), dict(self.params)
+            return self.compile()
+
+        def _expanding(self, params):
+            # Names of the parameters holding several values.
+            return tuple(sorted(k for k, v in params.items() if isinstance(v, (list, tuple))))
+
+        def _text(self, command, expanding=()):
+            from sqlalchemy import bindparam, text
+            statement = text(command)
+            if expanding:
+                statement = statement.bindparams(*[bindparam(k, expanding=True) for k in expanding])
+            return statement
+
+        def _render(self, dialect=None, suffix=''):
+            # Writes the statement out with :name placeholders. Parameters
+            # of combined statements get suffix added to their names.
+            import re
+            tree = self.tree
+            tab = ' ' * self.tabspace
+            top = tree['limit'] and not tree['offset'] and dialect == 'mssql'
+            command = 'SELECT TOP (:_limit)' if top else 'SELECT'
+            cols = tree['cols']
+            if cols:
+                if isinstance(cols, str):
+                    command += f' {cols}\n'
+                else:
+                    command += f'\n{tab}' + f'\n{tab},'.join(cols) + '\n'
+            else:
+                command += ' *\n'
+            command += f"FROM {tree['table']}\n"
+            for how, table, on in tree['joins']:
+                command += f'{how} JOIN {table}' + (f' ON {on}\n' if on else '\n')
+            for clause, keyword in (('where', 'WHERE'), ('having', 'HAVING')):
+                conditions = tree[clause]
+                if clause == 'having' and tree['group_by']:
+                    command += f"GROUP BY {', '.join(tree['group_by'])}\n"
+                if len(conditions) > 1:
+                    conditions = [f'({c})' for c in conditions]
+                if conditions:
+                    command += f'{keyword} ' + '\nAND '.join(conditions) + '\n'
+            for i, (other, (all, _)) in enumerate(zip(self._unions, tree['unions'])):
+                command += 'UNION ALL\n' if all else 'UNION\n'
+                member = other._render(dialect, suffix=f'{suffix}_u{i}')
+                if other.tree['order_by'] or other.tree['limit']:
+                    # Its ORDER BY and LIMIT would otherwise apply to the
+                    # whole union, so it is read as a subquery.
+                    member = ''.join(tab + line for line in member.splitlines(True))
+                    member = f'SELECT *\nFROM (\n{member}) AS _u{i}\n'
+                command += member
+            if tree['order_by']:
+                command += f"ORDER BY {', '.join(tree['order_by'])}\n"
+            if tree['offset'] and dialect == 'mssql':
+                command += 'OFFSET :_offset ROWS\nFETCH NEXT :_limit ROWS ONLY\n'
+            elif tree['limit'] and not top:
+                command += 'LIMIT :_limit\n'
+                if tree['offset']:
+                    command += 'OFFSET :_offset\n'
+            if suffix:
+                for name in self.params:
+                    command = re.sub(rf'(?<![:\w]):{name}(?!\w)', f':{name}{suffix}', command)
+            return command
+
+        def _params(self, suffix=''):
+            # Gathers the parameters of this and every combined statement,
+            # named as _render writes them.
+            params = {f'{name}{suffix}': value for name, value in self.params.items()}
+            for i, other in enumerate(self._unions):
+                params.update(other._params(suffix=f'{suffix}_u{i}'))
+            return params
+
+        def _literal(self, command, params):
+            # Writes parameter values into the command in place of their
+            # placeholders.
+            import re
+
+            def literal(value):
+                if isinstance(value, (list, tuple)):
+                    return '(' + ', '.join(map(literal, value)) + ')'
+                if value is None:
+                    return 'NULL'
+                if isinstance(value, (int, float)):
+                    return str(value)
+                return "'" + str(value).replace("'", "''") + "'"
+
+            if not params:
+                return command
+            names = '|'.join(sorted(map(re.escape, params), key=len, reverse=True))
+            return re.sub(rf'(?<![:\w]):({names})(?!\w)', lambda m: literal(params[m.group(1)]), command)
+
+        @contextmanager
+        def prepared(self):
+            '''
+            Prepares the statement once on a DB-API cursor and yields a
+            function that runs it with new parameter values, returning a
+            DataFrame. Values not given keep those the statement was built
+            with. Meant for many quick lookups that differ only in values:
+                sql = cz.select_from('t').where('id = :id', id=0)
+                with sql.prepared() as run:
+                    dfs = [run(id=i) for i in ids]
+            mysql-connector and psycopg 3 prepare the statement on the
+            server, and sqlite3 keeps it parsed on its connection. Drivers
+            without prepared statements, such as pymysql and psycopg2, run
+            it on the one connection instead. The result cache is not used,
+            and parameters holding several values can't be prepared.
+            '''
+            import pandas as pd
+            statement, params = self._statement()
+            if isinstance(statement, str):
+                statement = self._text(statement)
+            if self._expanding(params or {}):
+                raise ValueError('parameters holding several values can\'t be prepared.')
+            dialect = self.engine.dialect
+            compiled = statement.compile(dialect=dialect)
+            command = str(compiled)
+            raw = self.engine.raw_connection()
+            try:
+                if dialect.driver == 'mysqlconnector':
+                    cursor = raw.cursor(prepared=True)
+                else:
+                    cursor = raw.cursor()
+                kwargs = {'prepare': True} if dialect.driver == 'psycopg' else {}
+
+                def run(**values):
+                    args = compiled.construct_params({**(params or {}), **values})
+                    if dialect.positional:
+                        args = [args[k] for k in compiled.positiontup]
+                    cursor.execute(command, args, **kwargs)
+                    columns = [d[0] for d in cursor.description]
+                    return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+                yield run
+                cursor.close()
+            finally:
+                raw.close()
+
+        def explain(self, analyze=False):
+            '''
+            Returns the plan the database has for the statement as a
+            DataFrame, one row per plan node, with the estimated rows and
+            cost of each. Nodes are flagged when they scan a whole table,
+            sort the results themselves (a filesort) or build a temporary
+            table, so slow queries can be caught in tests:
+                plan = cz.select_from('t').where('id = :id', id=1).explain()
+                assert not plan['full_scan'].any()
+            analyze runs the statement as well and adds the actual rows and
+            time of each node. SQLite gives no estimates, and its plan is
+            the same either way.
+            params:
+                analyze     run the statement to add actual rows and times
+                            (MySQL, MariaDB and PostgreSQL only).
+            '''
+            statement, params, kind = self._explain(analyze)
+            with self._connect() as con:
+                rows = con.execute(statement, params).fetchall()
+            return self._plan(rows, kind)
+
+        def _explain(self, analyze=False):
+            # Returns the EXPLAIN statement for the engine's dialect, its
+            # parameters and which parser reads its output.
+            statement, params = self._statement()
+            params = params or {}
+            command = getattr(statement, 'text', statement).rstrip().rstrip(';').rstrip()
+            dialect = self.engine.dialect
+            if dialect.name == 'mysql':
+                if not analyze:
+                    kind, prefix = 'mysql', 'EXPLAIN FORMAT=JSON'
+                elif getattr(dialect, 'is_mariadb', False):
+                    kind, prefix = 'mysql', 'ANALYZE FORMAT=JSON'
+                else:
+                    # MySQL only analyzes in its tree format.
+                    kind, prefix = 'mysql_tree', 'EXPLAIN ANALYZE'
+            elif dialect.name == 'postgresql':
+                kind = 'postgresql'
+                prefix = 'EXPLAIN (ANALYZE, FORMAT JSON)' if analyze else 'EXPLAIN (FORMAT JSON)'
+            elif dialect.name == 'sqlite':
+                kind, prefix = 'sqlite', 'EXPLAIN QUERY PLAN'
+            else:
+                raise ValueError(f'plans cannot be read from {dialect.name}.')
+            return self._text(f'{prefix} {command}', self._expanding(params)), params, kind
+
+        def _plan(self, rows, kind):
+            import json
+            import pandas as pd
+            if kind == 'sqlite':
+                nodes = self._sqlite_plan(rows)
+            elif kind == 'mysql_tree':
+                nodes = self._mysql_tree_plan(rows[0][0])
+            else:
+                doc = rows[0][0]
+                if isinstance(doc, (str, bytes)):
+                    doc = json.loads(doc)
+                if kind == 'postgresql':
+                    nodes = self._postgres_plan(doc[0]['Plan'])
+                else:
+                    nodes = self._mysql_plan(doc)
+            df = pd.DataFrame(nodes, columns=list(self._plan_node(0, None)))
+            for col in ('rows', 'cost', 'actual_rows', 'actual_time'):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            return df
+
+        def _plan_node(self, depth, operation, table=None, index=None, rows=None, cost=None,
+                       actual_rows=None, actual_time=None, full_scan=False, filesort=False, temporary=False):
+            return {
+                'depth': depth,
+                'operation': operation,
+                'table': table,
+                'index': index,
+                'rows': rows,
+                'cost': cost,
+                'actual_rows': actual_rows,
+                'actual_time': actual_time,
+                'full_scan': full_scan,
+                'filesort': filesort,
+                'temporary': temporary,
+            }
+
+        def _mysql_plan(self, node, key=None, depth=0, nodes=None):
+            # Walks MySQL and MariaDB FORMAT=JSON plans. Tables and the
+            # sorting and grouping steps above them become nodes.
+            if nodes is None:
+                nodes = []
+            if isinstance(node, list):
+                for item in node:
+                    self._mysql_plan(item, key, depth, nodes)
+                return nodes
+            if not isinstance(node, dict):
+                return nodes
+            cost = node.get('cost_info', {})
+            if 'table_name' in node:
+                access = node.get('access_type')
+                nodes.append(self._plan_node(
+                    depth, access, table=node['table_name'], index=node.get('key'),
+                    rows=node.get('rows_examined_per_scan', node.get('rows')),
+                    cost=cost.get('prefix_cost', cost.get('read_cost')),
+                    actual_rows=node.get('r_rows'), actual_time=node.get('r_total_time_ms'),
+                    full_scan=access == 'ALL',
+                    filesort=bool(node.get('using_filesort')),
+                    temporary=bool(node.get('using_temporary_table'))))
+                depth += 1
+            elif key in ('query_block', 'ordering_operation', 'grouping_operation', 'duplicates_removal',
+                         'windowing', 'filesort', 'temporary_table', 'read_sorted_file'):
+                nodes.append(self._plan_node(
+                    depth, key, cost=cost.get('query_cost', cost.get('sort_cost')),
+                    actual_time=node.get('r_total_time_ms'),
+                    filesort=key == 'filesort' or bool(node.get('using_filesort')),
+                    temporary=key == 'temporary_table' or bool(node.get('using_temporary_table'))))
+                depth += 1
+            for k, v in node.items():
+                if isinstance(v, (dict, list)) and k != 'cost_info':
+                    self._mysql_plan(v, k, depth, nodes)
+            return nodes
+
+        def _mysql_tree_plan(self, text):
+            # Reads the indented lines of MySQL's EXPLAIN ANALYZE, such as
+            # -> Table scan on t  (cost=1.25 rows=10) (actual time=0.02..0.03 rows=10 loops=1)
+            import re
+            nodes = []
+            for line in text.splitlines():
+                if '->' not in line:
+                    continue
+                indent, step = line.split('->', 1)
+                operation = re.split(r'\s+\((?:cost|actual)', step.strip())[0]
+                table = re.search(r' on (\w+)', operation)
+                index = re.search(r' using (\w+)', operation)
+                estimate = re.search(r'\(cost=([\d.e+]+) rows=([\d.e+]+)\)', step)
+                actual = re.search(r'\(actual time=[\d.e+]+\.\.([\d.e+]+) rows=([\d.e+]+) loops=(\d+)\)', step)
+                nodes.append(self._plan_node(
+                    len(indent) // 4, operation,
+                    table=table and table.group(1), index=index and index.group(1),
+                    rows=estimate and estimate.group(2), cost=estimate and estimate.group(1),
+                    actual_rows=actual and float(actual.group(2)) * int(actual.group(3)),
+                    actual_time=actual and float(actual.group(1)) * int(actual.group(3)),
+                    full_scan=operation.startswith('Table scan'),
+                    filesort=operation.startswith('Sort'),
+                    temporary='temporary' in operation))
+            return nodes
+
+        def _postgres_plan(self, plan, depth=0, nodes=None):
+            if nodes is None:
+                nodes = []
+            kind = plan.get('Node Type')
+            nodes.append(self._plan_node(
+                depth, kind, table=plan.get('Relation Name'), index=plan.get('Index Name'),
+                rows=plan.get('Plan Rows'), cost=plan.get('Total Cost'),
+                actual_rows=plan.get('Actual Rows'), actual_time=plan.get('Actual Total Time'),
+                full_scan=kind == 'Seq Scan',
+                filesort=kind in ('Sort', 'Incremental Sort'),
+                # Steps that spill to disk work through temporary files.
+                temporary=kind == 'Materialize' or plan.get('Sort Space Type') == 'Disk' or bool(plan.get('Disk Usage'))))
+            for child in plan.get('Plans', []):
+                self._postgres_plan(child, depth + 1, nodes)
+            return nodes
+
+        def _sqlite_plan(self, rows):
+            # EXPLAIN QUERY PLAN rows are (id, parent, notused, detail),
+            # such as SCAN t or SEARCH t USING INDEX i (id=?).
+            import re
+            nodes = []
+            depths = {}
+            for id, parent, _, detail in rows:
+                depth = depths[parent] + 1 if parent in depths else 0
+                depths[id] = depth
+                step = re.match(r'(SCAN|SEARCH) (?:TABLE )?(\w+)', detail)
+                index = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+                if index:
+                    index = index.group(1)
+                elif 'PRIMARY KEY' in detail:
+                    index = 'PRIMARY KEY'
+                # An automatic index is built for the one query and dropped.
+                automatic = 'AUTOMATIC' in detail
+                nodes.append(self._plan_node(
+                    depth, detail,
+                    table=step and step.group(2),
+                    index='AUTOMATIC' if automatic else index,
+                    full_scan=bool(step) and step.group(1) == 'SCAN' and 'INDEX' not in detail,
+                    filesort='TEMP B-TREE FOR ORDER BY' in detail,
+                    temporary=automatic or 'TEMP B-TREE' in detail))
+            return nodes
+
+        def stream(self, chunksize=100000, tuples=False):
+            '''
+            Yields the results chunksize rows at a time, as DataFrames or as
+            lists of row tuples if tuples. A server side cursor is used, so
+            only the chunk being read is held in memory. The connection is
+            held until the results are exhausted or the generator is closed.
+            '''
+            import pandas as pd
+            statement, params = self._statement()
+            with self._connect() as con:
+                con = con.execution_options(stream_results=True)
+                if not tuples:
+                    yield from pd.read_sql_query(statement, con, chunksize=chunksize, params=params)
+                    return
+                result = con.execute(statement, params) if params else con.execute(statement)
+                while True:
+                    rows = result.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    yield [tuple(row) for row in rows]
+
+        def to_csv(self, path, chunksize=100000, **kwargs):
+            '''
+            Writes the results to a csv file as they are streamed, chunksize
+            rows at a time. **kwargs are passed on to pandas to_csv.
+            '''
+            for i, df in enumerate(self.stream(chunksize=chunksize)):
+                df.to_csv(path, mode='a' if i else 'w', header=not i, index=False, **kwargs)
+            return f'results written to {path}.'
+
+        def to_parquet(self, path, chunksize=100000, **kwargs):
+            '''
+            Writes the results to a Parquet file as they are streamed, one
+            row group per chunk. The column types are taken from the first
+            chunk. **kwargs are passed on to pyarrow's ParquetWriter.
+            '''
+            writer = None
+            try:
+                for df in self.stream(chunksize=chunksize):
+                    writer = self._write_parquet(writer, df, path, **kwargs)
+            finally:
+                if writer is not None:
+                    writer.close()
+            return f'results written to {path}.'
+
+        def _write_parquet(self, writer, df, path, **kwargs):
+            # Appends df to writer, opening it with the schema of the first
+            # chunk if None. Columns that were all null in it are widened to
+            # strings, as later chunks could hold anything.
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                fields = [f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                          for f in table.schema]
+                schema = pa.schema(fields, metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(path, schema, **kwargs)
+            writer.write_table(table.cast(writer.schema))
+            return writer
+
+    class Cache:
+        '''
+        The Cache object keeps the results of SQL.ex() so that repeated
+        queries are answered without going back to the server. It is opt-in,
+        given as CZ(engine, cache=CZ.Cache()). Results are keyed on their SQL,
+        with whitespace normalized, and the database. The least recently
+        used are evicted past maxsize, and, if path is given, moved to
+        Parquet files there until disksize more are kept. Entries are
+        dropped whenever a CZ write method touches a table their SQL names.
+        params:
+            maxsize     the number of results kept in memory.
+            ttl         seconds a result stays valid for. None keeps it until
+                        it is evicted or invalidated.
+            path        folder results evicted from memory are written to as
+                        Parquet files. None disables the disk tier.
+            disksize    the number of results kept on disk.
+        '''
+
+        def __init__(self, maxsize=128, ttl=None, path=None, disksize=1024):
+            import threading
+            from collections import OrderedDict
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.path = path
+            self.disksize = disksize
+            # key: (expiry time, words in the SQL, DataFrame or file path)
+            self._memory = OrderedDict()
+            self._disk = OrderedDict()
+            # Shared by every worker copy of a CZ.
+            self._lock = threading.Lock()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+        def _key(self, command, database=None, params=None):
+            params = repr(sorted(params.items())) if params else None
+            return (' '.join(command.split()).rstrip(' ;'), database, params)
+
+        def get(self, command, database=None, params=None):
+            '''
+            Returns a copy of the cached result of command run with params,
+            or None.
+            '''
+            import time
+            import pandas as pd
+            key = self._key(command, database, params)
+            with self._lock:
+                now = time.time()
+                entry = self._memory.get(key)
+                if entry and entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[2].copy()
+                entry = self._disk.pop(key, None)
+                if entry and entry[0] > now:
+                    df = pd.read_parquet(entry[2])
+                    self._drop_file(entry[2])
+                    self.disk_hits += 1
+                    self._store(key, entry[0], entry[1], df)
+                    return df.copy()
+                if entry:
+                    self._drop_file(entry[2])
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+
+        def put(self, command, df, database=None, params=None):
+            import re
+            import time
+            key = self._key(command, database, params)
+            expiry = time.time() + self.ttl if self.ttl is not None else float('inf')
+            # Every word is kept, so a table is recognised wherever it
+            # appears. Matching a column of the same name only means an
+            # entry is dropped when it needn't be.
+            words = frozenset(re.findall(r'\w+', command.lower()))
+            with self._lock:
+                self._store(key, expiry, words, df.copy())
+
+        def _store(self, key, expiry, words, df):
+            import hashlib
+            import os
+            self._memory[key] = (expiry, words, df)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                old_key, (old_expiry, old_words, old_df) = self._memory.popitem(last=False)
+                self.evictions += 1
+                if self.path is None:
+                    continue
+                os.makedirs(self.path, exist_ok=True)
+                name = hashlib.sha1(repr(old_key).encode()).hexdigest() + '.parquet'
+                file = os.path.join(self.path, name)
+                try:
+                    old_df.to_parquet(file, index=False)
+                except (ValueError, TypeError, NotImplementedError, ImportError):
+                    # Results Parquet can't hold are simply dropped.
+                    continue
+                self._disk[old_key] = (old_expiry, old_words, file)
+                while len(self._disk) > self.disksize:
+                    self._drop_file(self._disk.popitem(last=False)[1][2])
+
+        def _drop_file(self, file):
+            import os
+            if os.path.exists(file):
+                os.remove(file)
+
+        def invalidate(self, table=None):
+            '''
+            Drops every result whose SQL names table, with or without its
+            database, or every result if table is None.
+            '''
+            name = table.split('.')[-1].strip('`"[]').lower() if table else None
+            with self._lock:
+                for tier in (self._memory, self._disk):
+                    for key in [k for k, v in tier.items() if name is None or name in v[1]]:
+                        entry = tier.pop(key)
+                        if tier is self._disk:
+                            self._drop_file(entry[2])
+                        self.invalidations += 1
+
+        def stats(self):
+            '''
+            Returns the cache's hit, miss, eviction and invalidation counts
+            and how many results are held in memory and on disk.
+            '''
+            with self._lock:
+                lookups = self.hits + self.disk_hits + self.misses
+                return {
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'memory': len(self._memory),
+                    'disk': len(self._disk),
+                }
+
+    class Catalog:
+        '''
+        The Catalog object keeps the tables, columns, indexes and constraints
+        of each database, loaded with a handful of bulk INFORMATION_SCHEMA
+        queries the first time a database is looked up, so that show_tables
+        and show_columns are answered from memory. It is opt-in, given as
+        CZ(engine, catalog=True). CZ's DDL methods reload only the tables
+        they change, and cz.refresh_catalog() drops what is held so it is
+        loaded again. Every method takes the CZ to query through, so worker
+        copies can share one Catalog.
+        '''
+
+        def __init__(self):
+            import threading
+            # database: {'tables': [...], 'columns': {table: DataFrame}, ...}
+            self._databases = {}
+            self._lock = threading.RLock()
+
+        def _queries(self, cz, database=None, table=None):
+            # Returns the SQL that reads each kind of metadata, for a whole
+            # database or a single table, and its parameters.
+            dialect = cz.engine.dialect.name
+            params = {'db': database, 'table': table}
+            if dialect == 'mysql':
+                schema = ':db' if database else 'DATABASE()'
+                where = f'TABLE_SCHEMA = {schema}'
+                if table:
+                    where += ' AND TABLE_NAME = :table'
+                queries = {
+                    'tables': f"SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE {where} AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME",
+                    'columns': 'SELECT TABLE_NAME, COLUMN_NAME AS Field, COLUMN_TYPE AS Type, IS_NULLABLE AS `Null`'
+                               ', COLUMN_KEY AS `Key`, COLUMN_DEFAULT AS `Default`, EXTRA AS Extra'
+                               f' FROM INFORMATION_SCHEMA.COLUMNS WHERE {where} ORDER BY TABLE_NAME, ORDINAL_POSITION',
+                    'indexes': 'SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME'
+                               f' FROM INFORMATION_SCHEMA.STATISTICS WHERE {where} ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX',
+                    'constraints': 'SELECT c.TABLE_NAME, c.CONSTRAINT_NAME, c.CONSTRAINT_TYPE, k.COLUMN_NAME'
+                                   ', k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME'
+                                   ' FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS c'
+                                   ' JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k'
+                                   ' ON k.CONSTRAINT_SCHEMA = c.CONSTRAINT_SCHEMA AND k.CONSTRAINT_NAME = c.CONSTRAINT_NAME'
+                                   ' AND k.TABLE_NAME = c.TABLE_NAME'
+                                   f" WHERE c.{where.replace(' AND ', ' AND c.')} ORDER BY c.TABLE_NAME, c.CONSTRAINT_NAME, k.ORDINAL_POSITION",
+                }
+                return queries, params
+            if dialect == 'postgresql':
+                schema = ':db' if database else 'current_schema()'
+                table_filter = ' AND {}table_name = :table' if table else ''
+                key_filter = table_filter.format('c.')
+                queries = {
+                    'tables': 'SELECT table_name AS "TABLE_NAME" FROM information_schema.tables'
+                              f" WHERE table_schema = {schema} AND table_type = 'BASE TABLE'{table_filter.format('')}"
+                              ' ORDER BY table_name',
+                    'columns': 'SELECT c.table_name AS "TABLE_NAME", c.column_name AS "Field", c.data_type AS "Type"'
+                               ', c.is_nullable AS "Null", CASE WHEN p.column_name IS NULL THEN \'\' ELSE \'PRI\' END AS "Key"'
+                               ', c.column_default AS "Default", \'\' AS "Extra"'
+                               ' FROM information_schema.columns c'
+                               ' LEFT JOIN (SELECT k.table_schema, k.table_name, k.column_name'
+                               ' FROM information_schema.table_constraints t'
+                               ' JOIN information_schema.key_column_usage k'
+                               ' ON k.constraint_schema = t.constraint_schema AND k.constraint_name = t.constraint_name'
+                               " WHERE t.constraint_type = 'PRIMARY KEY') p"
+                               ' ON p.table_schema = c.table_schema AND p.table_name = c.table_name AND p.column_name = c.column_name'
+                               f' WHERE c.table_schema = {schema}{key_filter} ORDER BY c.table_name, c.ordinal_position',
+                    'indexes': 'SELECT tablename AS "TABLE_NAME", indexname AS "INDEX_NAME", indexdef AS "DEFINITION"'
+                               f" FROM pg_indexes WHERE schemaname = {schema}{table_filter.format('').replace('table_name', 'tablename')}"
+                               ' ORDER BY tablename, indexname',
+                    'constraints': 'SELECT c.table_name AS "TABLE_NAME", c.constraint_name AS "CONSTRAINT_NAME"'
+                                   ', c.constraint_type AS "CONSTRAINT_TYPE", k.column_name AS "COLUMN_NAME"'
+                                   ', u.table_name AS "REFERENCED_TABLE_NAME", u.column_name AS "REFERENCED_COLUMN_NAME"'
+                                   ' FROM information_schema.table_constraints c'
+                                   ' JOIN information_schema.key_column_usage k'
+                                   ' ON k.constraint_schema = c.constraint_schema AND k.constraint_name = c.constraint_name'
+                                   ' LEFT JOIN information_schema.constraint_column_usage u'
+                                   " ON u.constraint_schema = c.constraint_schema AND u.constraint_name = c.constraint_name AND c.constraint_type = 'FOREIGN KEY'"
+                                   f' WHERE c.table_schema = {schema}{key_filter} ORDER BY c.table_name, c.constraint_name, k.ordinal_position',
+                }
+                return queries, params
+            return None, params
+
+        def _inspect(self, cz, database=None, table=None):
+            # Dialects without INFORMATION_SCHEMA, such as SQLite, are read
+            # table by table through SQLAlchemy's inspector.
+            import pandas as pd
+            from sqlalchemy import inspect
+            frames = {'tables': [], 'columns': [], 'indexes': [], 'constraints': []}
+            with cz._connection() as con:
+                inspector = inspect(con)
+                names = inspector.get_table_names(schema=database)
+                for name in [table] if table else names:
+                    if name not in names:
+                        continue
+                    frames['tables'].append({'TABLE_NAME': name})
+                    pkey = inspector.get_pk_constraint(name, schema=database)
+                    for col in inspector.get_columns(name, schema=database):
+                        frames['columns'].append({
+                            'TABLE_NAME': name,
+                            'Field': col['name'],
+                            'Type': str(col['type']),
+                            'Null': 'YES' if col.get('nullable', True) else 'NO',
+                            'Key': 'PRI' if col['name'] in pkey.get('constrained_columns', []) else '',
+                            'Default': col.get('default'),
+                            'Extra': '',
+                        })
+                    for index in inspector.get_indexes(name, schema=database):
+                        for i, col in enumerate(index['column_names']):
+                            frames['indexes'].append({
+                                'TABLE_NAME': name,
+                                'INDEX_NAME': index['name'],
+                                'NON_UNIQUE': int(not index.get('unique')),
+                                'SEQ_IN_INDEX': i + 1,
+                                'COLUMN_NAME': col,
+                            })
+                    for col in pkey.get('constrained_columns', []):
+                        frames['constraints'].append({
+                            'TABLE_NAME': name,
+                            'CONSTRAINT_NAME': pkey.get('name') or 'PRIMARY',
+                            'CONSTRAINT_TYPE': 'PRIMARY KEY',
+                            'COLUMN_NAME': col,
+                        })
+                    for fkey in inspector.get_foreign_keys(name, schema=database):
+                        for col, ref in zip(fkey['constrained_columns'], fkey['referred_columns']):
+                            frames['constraints'].append({
+                                'TABLE_NAME': name,
+                                'CONSTRAINT_NAME': fkey.get('name'),
+                                'CONSTRAINT_TYPE': 'FOREIGN KEY',
+                                'COLUMN_NAME': col,
+                                'REFERENCED_TABLE_NAME': fkey['referred_table'],
+                                'REFERENCED_COLUMN_NAME': ref,
+                            })
+            return {kind: pd.DataFrame(rows, columns=None if rows else ['TABLE_NAME'])
+                    for kind, rows in frames.items()}
+
+        def _fetch(self, cz, database=None, table=None):
+            # Reads the metadata of a database, or one of its tables, into a
+            # DataFrame per kind, each with a TABLE_NAME column.
+            import pandas as pd
+            from sqlalchemy import text
+            queries, params = self._queries(cz, database=database, table=table)
+            if queries is None:
+                return self._inspect(cz, database=database, table=table)
+            with cz._connection() as con:
+                return {kind: pd.read_sql_query(text(query), con, params=params)
+                        for kind, query in queries.items()}
+
+        def _split(self, frames):
+            # Splits the metadata into a list of tables and dictionaries of
+            # table: DataFrame for the rest.
+            entry = {'tables': frames['tables']['TABLE_NAME'].tolist()}
+            for kind in ('columns', 'indexes', 'constraints'):
+                df = frames[kind]
+                entry[kind] = {name: group.drop(columns='TABLE_NAME').reset_index(drop=True)
+                               for name, group in df.groupby('TABLE_NAME', sort=False)}
+            return entry
+
+        def _current(self, cz):
+            # Returns the name of the database tables are listed from when
+            # none is given, or None if there isn't one.
+            from sqlalchemy import text
+            dialect = cz.engine.dialect.name
+            if dialect == 'sqlite':
+                return 'main'
+            command = {
+                'mysql': 'SELECT DATABASE()',
+                'postgresql': 'SELECT current_schema()',
+                'mssql': 'SELECT DB_NAME()',
+            }.get(dialect)
+            if command is None:
+                return None
+            with cz._connection() as con:
+                return con.execute(text(command)).scalar()
+
+        def _entry(self, cz, database=None):
+            with self._lock:
+                if database not in self._databases:
+                    entry = self._split(self._fetch(cz, database=database))
+                    entry['database'] = database or self._current(cz)
+                    self._databases[database] = entry
+                return self._databases[database]
+
+        def name(self, cz, database=None):
+            '''
+            Returns the name of database, or of the current one.
+            '''
+            return self._entry(cz, database)['database']
+
+        def tables(self, cz, database=None):
+            '''
+            Returns the names of the tables in database, or the current one.
+            '''
+            return list(self._entry(cz, database)['tables'])
+
+        def columns(self, cz, table, database=None):
+            '''
+            Returns the columns of table as SHOW COLUMNS would, or None if
+            the table isn't known.
+            '''
+            entry = self._entry(cz, database)
+            if table not in entry['tables']:
+                return None
+            return entry['columns'].get(table).copy()
+
+        def indexes(self, cz, table, database=None):
+            # Returns the indexes of table, a row per indexed column.
+            import pandas as pd
+            return self._entry(cz, database)['indexes'].get(table, pd.DataFrame()).copy()
+
+        def constraints(self, cz, table, database=None):
+            # Returns the constraints of table, a row per constrained column.
+            import pandas as pd
+            return self._entry(cz, database)['constraints'].get(table, pd.DataFrame()).copy()
+
+        def refresh(self, cz, table=None, database=None):
+            '''
+            Reloads the metadata of table, if its database has already been
+            loaded, or drops everything held for database if table is None
+            so it is loaded again when next looked up. A table given as
+            database.table is looked up in that database.
+            '''
+            if table and '.' in table:
+                database, _, table = table.rpartition('.')
+            with self._lock:
+                if table is None:
+                    self._databases.pop(database, None)
+                    return
+                entry = self._databases.get(database)
+                if entry is None:
+                    return
+                fresh = self._split(self._fetch(cz, database=database, table=table))
+                if table in fresh['tables']:
+                    if table not in entry['tables']:
+                        entry['tables'].append(table)
+                elif table in entry['tables']:
+                    entry['tables'].remove(table)
+                for kind in ('columns', 'indexes', 'constraints'):
+                    entry[kind].pop(table, None)
+                    if table in fresh[kind]:
+                        entry[kind][table] = fresh[kind][table]
+
+    @contextmanager
+    def session(self):
+        '''
+        Opens a connection that every CZ method reuses until the with block
+        exits, instead of checking out a new one per statement. Statements
+        run in a single transaction that is committed on exit or rolled back
+        if an error is raised. Nested sessions join the outermost one.
+        A session is not shared between threads, so workers should each use
+        their own CZ.
+            with cz.session() as con:
+                cz.mk_db('testDB')
+                cz.use_db('testDB')
+        '''
+        if self._con is not None:
+            yield self._con
+            return
+        con = self._checkout()
+        transaction = self._begin(con)
+        self._con = con
+        try:
+            yield con
+            transaction.commit()
+        except BaseException:
+            transaction.rollback()
+            raise
+        finally:
+            self._con = None
+            con.close()
+
+    @contextmanager
+    def _connection(self):
+        # Uses the open session if there is one, otherwise a connection that
+        # commits and is returned to the pool when done.
+        if self._con is not None:
+            yield self._con
+            return
+        with self._checkout() as con:
+            with self._begin(con):
+                yield con
+
+    def _begin(self, con):
+        # pysqlite only opens its transaction at the first write, so the
+        # SAVEPOINT of a nested block would open it and its RELEASE commit
+        # it. BEGIN is sent up front to keep the whole block in one
+        # transaction that can still be rolled back. IMMEDIATE takes the
+        # write lock at once, so concurrent writers wait their turn rather
+        # than fail when both try to upgrade a read lock.
+        transaction = con.begin()
+        if con.dialect.name == 'sqlite' and con.dialect.driver == 'pysqlite':
+            con.exec_driver_sql('BEGIN IMMEDIATE')
+        return transaction
+
+    def _checkout(self):
+        # Checks out a connection from the pool, timing how long it took.
+        import time
+        start = time.perf_counter()
+        con = self.engine.connect()
+        wait = time.perf_counter() - start
+        self._waits[0] += 1
+        self._waits[1] += wait
+        self._waits[2] = max(self._waits[2], wait)
+        return con
+
+    def _execute(self, command, *multiparams):
+        with self._connection() as con:
+            result = con.execute(command, *multiparams)
+            if result.returns_rows:
+                # Rows are buffered so the result outlives its connection.
+                result = result.freeze()()
+            return result
+
+    def pool_metrics(self):
+        '''
+        Returns the state of the engine's connection pool along with the
+        number of checkouts made by CZ and the time, in seconds, spent
+        waiting for them. Figures the pool class doesn't track are None.
+        '''
+        pool = self.engine.pool
+
+        def stat(name):
+            f = getattr(pool, name, None)
+            return f() if callable(f) else None
+
+        checkouts, wait_total, wait_max = self._waits
+        return {
+            'pool_size': stat('size'),
+            'checked_out': stat('checkedout'),
+            'checked_in': stat('checkedin'),
+            'overflow': stat('overflow'),
+            'session_open': self._con is not None,
+            'checkouts': checkouts,
+            'wait_total': wait_total,
+            'wait_max': wait_max,
+            'wait_mean': wait_total / checkouts if checkouts else 0.0,
+        }
+
+    def refresh_catalog(self, table=None):
+        '''
+        Reloads the catalog's metadata of table, or drops all of it so every
+        database is loaded again when next looked up.
+        '''
+        if self.catalog is None:
+            return 'no catalog to refresh.'
+        if table is None:
+            with self.catalog._lock:
+                self.catalog._databases.clear()
+            return 'catalog refreshed.'
+        if self.database and '.' not in table:
+            table = self.database + '.' + table
+        self.catalog.refresh(self, table)
+        return f'catalog refreshed for table {table}.'
+
+    def _refresh_catalog(self, table=None, database=None):
+        # Keeps the catalog in step with DDL run through CZ.
+        if self.catalog is not None:
+            if table and self.database and '.' not in table:
+                table = self.database + '.' + table
+            self.catalog.refresh(self, table, database=database)
+
+    def _invalidate(self, table=None):
+        # Drops cached results that could have been changed by a write to
+        # table, or every result if table is None.
+        if self.cache is not None:
+            self.cache.invalidate(table)
+
     def mk_db(self, db, charset='utf8', collate='utf8_general_ci', printable=False):
         command = f'CREATE DATABASE {db} CHARACTER SET {charset} COLLATE {collate};'
         if printable or self.engine is None:
             return command
         from sqlalchemy.exc import ProgrammingError
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
             return f'database {db} created.'
         except ProgrammingError as err:
             return err
@@ -83,7 +1283,8 @@ class CZ:
         if printable or self.engine is None:
             return command
         import pandas as pd
-        df = pd.read_sql_query(command, self.engine)
+        with self._connection() as con:
+            df = pd.read_sql_query(command, con)
         return df
 
     def del_db(self, db, printable=False):
@@ -92,7 +1293,9 @@ class CZ:
             return command
         from sqlalchemy.exc import InternalError
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
+            self._invalidate()
+            self._refresh_catalog(database=db)
             return f'database {db} deleted.'
         except InternalError as err:
             return err
@@ -102,7 +1305,7 @@ class CZ:
         command = 'SELECT DATABASE();'
         if printable or self.engine is None:
             return command
-        return self.engine.connect().execute(command).fetchone()[0]
+        return self._execute(command).fetchone()[0]
 
     def use_db(self, db=None, printable=False):
         if db is None:
@@ -110,7 +1313,11 @@ class CZ:
         command = f'USE {db};'
         if printable or self.engine is None:
             return command
-        self.engine.connect().execute(command)
+        self._execute(command)
+        # Cached results and the current database's tables are held under
+        # None, and now belong to another database.
+        self._invalidate()
+        self._refresh_catalog()
         return f'database {db} selected.'
 
     def unuse_db(self, printable=False, _db='2arnbzheo2j0gygkteu9ltxtabmzldvb'):
@@ -119,26 +1326,23 @@ class CZ:
         command += f'\nDROP DATABASE {_db};'
         if printable or self.engine is None:
             return command
-        self.engine.connect().execute(command)
+        self._execute(command)
+        self._invalidate()
+        self._refresh_catalog()
         return 'database deselected.'
 
-    def select_from(self, table, cols=None):
-        tab = ' ' * self.tabspace
-        command = 'SELECT'
-        if cols:
-            if isinstance(cols, str):
-                command += f' {cols}\n'
-            else:
-                command += f'\n{tab}'
-                for col in cols:
-                    command += f'{col}\n{tab},'
-                command = command[:-(self.tabspace+1)]
-        else:
-            command += f' *\n'
+    def select_from(self, table, cols=None, **params):
+        '''
+        Returns a SQL object selecting cols from table, to be extended with
+        its methods and run with .ex(). Values used in cols, such as the
+        :cut in 'age > :cut AS adult', are passed as bound parameters.
+        '''
         if self.database:
             table = self.database + '.' + table
-        command += f'FROM {table}\n;'
-        return self.SQL(command, engine=self.engine)
+        sql = self.SQL(engine=self.engine, tabspace=self.tabspace, cache=self.cache, database=self.database, table=table, cols=cols,
+                       connection=self._connection)
+        sql._bind(params)
+        return sql
 
     def csv_clean_colnames(self, file, sep=''):
         '''
@@ -147,43 +1351,440 @@ class CZ:
         letters to lowercase, replacing all remaining whitespaces with
         underscores, removing brackets, forward slashes, and other special
         characters. The csv file is then replaced with a copy of itself with
-        the cleaned column names.
+        the cleaned column names. Only the header is rewritten, the rest of
+        the file is block copied as is. Compressed files are decompressed and
+        compressed again as they are copied, so the whole file is rewritten.
+        To clean the column names without touching the file, pass
+        clean_colnames=True to csv_table or csv_insert instead.
         params:
             file        path of file wholse column names are to be cleaned.
             sep         The character(s) used to replace brackets and special
                         characters.
         '''
-        import re
         import csv
+        import io
         import os
+        import shutil
+
+        # Writes the cleaned header to a .tmp file and copies the rest of the
+        # file after it without parsing.
+        tempfile = file + '.tmp'
+        compression = self._compression(file)
+        with self._open(file, compression=compression) as infile, \
+                self._open(tempfile, 'wb', compression=compression) as outfile:
+            header = infile.readline()
+            newline = b'\r\n' if header.endswith(b'\r\n') else b'\n'
+            colnames = next(csv.reader([header.decode().rstrip('\r\n')], delimiter=',', quotechar='"'))
+            colnames = self._clean_colnames(colnames, sep=sep)
+            line = io.StringIO()
+            csv.writer(line, lineterminator='').writerow(colnames)
+            outfile.write(line.getvalue().encode() + newline)
+            shutil.copyfileobj(infile, outfile, 1048576)
+
+        # Replace the original with the cleaned file.
+        os.replace(tempfile, file)
+
+    def _clean_colnames(self, colnames, sep=''):
+        # Applies the cleaning described in csv_clean_colnames to a list of
+        # column names.
+        import re
 
         def remove_special_characters(text, sep=sep):
             pattern = r'[^a-zA-Z0-9!"#$%&\'()*+, -./:; <= >?@[\]^_`{|}~]'
             return re.sub(pattern, sep, text)
 
-        # Opens the csv file and writes the cleaned version to a .tmp file.
-        tempfile = file + '.tmp'
-        with open(file, 'r') as infile, open(tempfile, 'w', newline='') as outfile:
-            r = csv.reader(infile, delimiter=',', quotechar='"')
-            colnames = next(r)
-            colnames = [remove_special_characters(x.strip().lower().replace(' ', '_').replace(
-                '(', sep).replace(')', sep).replace('/', sep)) for x in colnames]
-            w = csv.writer(outfile)
-            w.writerow(colnames)
-            for row in r:
-                w.writerow(row)
-
-        # Delete original and replace it with the cleaned file.
-        os.remove(file)
-        os.rename(tempfile, file)
-
-    def csv_table(self, file, table=None, pkey=None, nrows=100000, printable=False, **kwargs):
+        return [remove_special_characters(x.strip().lower().replace(' ', '_').replace(
+            '(', sep).replace(')', sep).replace('/', sep)) for x in colnames]
+
+    def _file_format(self, file):
+        # Parquet and Feather/Arrow IPC files are read with pyarrow, anything
+        # else, including streams, is treated as csv.
+        from pathlib import Path
+        if hasattr(file, 'read'):
+            return 'csv'
+        suffix = Path(file).suffix.lower()
+        if suffix in ('.parquet', '.pq'):
+            return 'parquet'
+        if suffix in ('.feather', '.arrow', '.arrows', '.ipc'):
+            return 'arrow'
+        return 'csv'
+
+    def _file_stem(self, file):
+        # The file name without its extension, or both extensions for
+        # compressed files such as data.csv.gz.
+        from pathlib import Path
+        path = Path(file)
+        if path.suffix.lower() in self.compression_dic:
+            path = path.with_suffix('')
+        return path.stem
+
+    def _compression(self, file):
+        '''
+        Returns the compression of file as pandas names it, or None if it
+        isn't compressed. It is detected from the file's first bytes, so
+        misnamed files are still read, or from its extension if it's empty.
+        '''
+        from pathlib import Path
+        magic = {
+            b'\x1f\x8b': 'gzip',
+            b'BZh': 'bz2',
+            b'\x28\xb5\x2f\xfd': 'zstd',
+            b'\xfd7zXZ\x00': 'xz'
+        }
+        with open(file, 'rb') as f:
+            head = f.read(6)
+        for prefix, compression in magic.items():
+            if head.startswith(prefix):
+                return compression
+        if not head:
+            return self.compression_dic.get(Path(file).suffix.lower())
+        return None
+
+    def _open(self, file, mode='rb', compression=None):
+        '''
+        Opens file in binary mode, decompressing or compressing it on the fly.
+        When reading, compression is detected if not given. Reading zstd
+        needs the zstandard package.
+        '''
+        if compression is None and 'r' in mode:
+            compression = self._compression(file)
+        if compression == 'gzip':
+            import gzip
+            return gzip.open(file, mode)
+        if compression == 'bz2':
+            import bz2
+            return bz2.open(file, mode)
+        if compression == 'xz':
+            import lzma
+            return lzma.open(file, mode)
+        if compression == 'zstd':
+            import io
+            import zstandard
+            if 'r' in mode:
+                reader = zstandard.ZstdDecompressor().stream_reader(open(file, 'rb'), read_across_frames=True)
+                # Buffered so it can be read line by line.
+                return io.BufferedReader(reader, 1048576)
+            return zstandard.ZstdCompressor().stream_writer(open(file, 'wb'))
+        return open(file, mode)
+
+    def _data_size(self, file):
+        '''
+        Returns the size of file in bytes, or for compressed files an
+        estimate of their size once decompressed. gzip files record it in
+        their last 4 bytes, modulo 4GB. Failing that, it is extrapolated from
+        the compression ratio of the first MB or so.
+        '''
+        import os
+        import zlib
+        size = os.path.getsize(file)
+        compression = self._compression(file)
+        if compression is None:
+            return size
+        if compression == 'gzip':
+            with open(file, 'rb') as f:
+                f.seek(-4, 2)
+                isize = int.from_bytes(f.read(4), 'little')
+            # A smaller size than the file itself means it has wrapped.
+            if isize >= size:
+                return isize
+            decompressor = zlib.decompressobj(31)
+        elif compression == 'bz2':
+            import bz2
+            decompressor = bz2.BZ2Decompressor()
+        elif compression == 'xz':
+            import lzma
+            decompressor = lzma.LZMADecompressor()
+        else:
+            import zstandard
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+        consumed = produced = 0
+        with open(file, 'rb') as f:
+            # bz2 only returns anything once a whole block is in.
+            while consumed < 1048576 or not produced:
+                block = f.read(65536)
+                if not block:
+                    return produced
+                consumed += len(block)
+                produced += len(decompressor.decompress(block))
+        return int(size * produced / consumed)
+
+    def _read_chunks(self, file, chunksize=None, clean_colnames=False, skip=0, offset=None, budget=None, **kwargs):
+        '''
+        Returns an iterator over the DataFrames read from file, chunksize rows
+        at a time or the whole file at once if chunksize is None. Parquet
+        and Arrow files are instead read a row group or record batch at a
+        time if chunksize is None, and only usecols is taken from kwargs. If
+        clean_colnames, the column names are cleaned as they are read.
+        To resume a chunked read, csv files are seeked to the byte offset
+        given, other files skip their first skip chunks.
+        If budget is given instead of chunksize, chunks are sized to take up
+        about budget bytes in memory. csv chunks are resized as they are
+        read, Parquet and Arrow files are sized once from their first rows.
+        '''
+        import itertools
+        import pandas as pd
+        rows = self._budget_rows(budget) if budget and not chunksize else None
+        if self._file_format(file) != 'csv':
+            columns = kwargs.get('usecols')
+            if rows:
+                probe = next(self._arrow_batches(file, chunksize=rows(), columns=columns), None)
+                chunksize = rows(probe.to_pandas()) if probe is not None else None
+            batches = self._arrow_batches(file, chunksize=chunksize, columns=columns)
+            batches = itertools.islice(batches, skip, None)
+            reader = (batch.to_pandas() for batch in batches)
+        elif offset is not None:
+            reader = self._csv_chunks(file, rows or chunksize, offset=offset, **kwargs)
+        else:
+            # pandas only goes by the extension, so compression detected from
+            # the first bytes is passed on.
+            if 'compression' not in kwargs and not hasattr(file, 'read'):
+                kwargs['compression'] = self._compression(file)
+            if rows:
+                reader = self._sized_chunks(pd.read_csv(file, iterator=True, **kwargs), rows)
+            elif chunksize:
+                reader = pd.read_csv(file, chunksize=chunksize, **kwargs)
+            else:
+                reader = [pd.read_csv(file, **kwargs)]
+        for df in reader:
+            if clean_colnames:
+                df.columns = self._clean_colnames(df.columns)
+            yield df
+
+    def _csv_chunks(self, file, chunksize, offset=0, **kwargs):
+        '''
+        Reads a csv file chunksize lines at a time starting from a byte
+        offset, which is stored in each DataFrame's attrs['offset'] as the
+        offset the next chunk starts at. chunksize may also be a function
+        given the previous chunk that returns the size of the next.
+        Compressed files are decompressed as they are read, their offsets are
+        into the decompressed data and resuming decompresses up to it again.
+        '''
+        import io
+        import itertools
+        import pandas as pd
+        df = None
+        with self._open(file, compression=kwargs.pop('compression', None)) as f:
+            header = f.readline()
+            if offset and f.seekable():
+                f.seek(offset)
+            elif offset:
+                # zstd streams can only be read forward.
+                while f.tell() < offset and f.read(min(offset - f.tell(), 1048576)):
+                    pass
+            while True:
+                size = chunksize(df) if callable(chunksize) else chunksize
+                lines = list(itertools.islice(f, size))
+                if not lines:
+                    break
+                block = b''.join(lines)
+                # A value with a newline in it spans several lines, so reading
+                # carries on until every quote is closed.
+                while block.count(b'"') % 2:
+                    line = f.readline()
+                    if not line:
+                        break
+                    block += line
+                df = pd.read_csv(io.BytesIO(header + block), **kwargs)
+                df.attrs['offset'] = f.tell()
+                yield df
+
+    def _sized_chunks(self, reader, rows):
+        # Reads each chunk from a pandas TextFileReader with as many rows as
+        # rows(previous chunk) asks for.
+        df = None
+        with reader:
+            while True:
+                try:
+                    df = reader.get_chunk(rows(df))
+                except StopIteration:
+                    return
+                yield df
+
+    def _budget_rows(self, budget, first=1000):
+        '''
+        Returns a function that is given the last chunk read and returns how
+        many rows the next chunk should have to take up about budget bytes,
+        going by the chunk's memory_usage(deep=True). The first chunk, which
+        there is nothing to measure for, has first rows.
+        '''
+        def rows(df=None):
+            if df is None or df.empty:
+                return first
+            row_bytes = df.memory_usage(index=False, deep=True).sum() / len(df)
+            return max(1, int(budget // max(row_bytes, 1)))
+        return rows
+
+    def _parse_size(self, size):
+        '''
+        Returns a size such as 512MB, 2 GB or 1048576 in bytes. Units are
+        powers of 1024.
+        '''
+        import re
+        if isinstance(size, (int, float)):
+            return int(size)
+        match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)I?B?\s*', str(size).upper())
+        if match is None:
+            raise ValueError(f'cannot read {size} as a size in bytes.')
+        number, unit = match.groups()
+        return int(float(number) * 1024 ** ' KMGT'.index(unit or ' '))
+
+    def _load_checkpoint(self, path, file, table, chunksize, resume=False):
+        '''
+        Returns the checkpoint manifest at path if resuming a load of the same
+        unchanged file, otherwise a fresh one.
+        '''
+        import json
+        import os
+        stat = os.stat(file)
+        manifest = {
+            'file': os.path.abspath(file),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'table': table,
+            'chunksize': chunksize,
+            'chunk': 0,
+            'offset': 0 if self._file_format(file) == 'csv' else None,
+            'rows': 0,
+            'complete': False,
+        }
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            keys = ['file', 'size', 'mtime', 'table', 'chunksize']
+            if all(saved.get(k) == manifest[k] for k in keys):
+                return saved
+        return manifest
+
+    def _save_checkpoint(self, path, manifest):
+        # Written to a .tmp file first so a crash can't leave it half written.
+        import json
+        import os
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _arrow_batches(self, file, chunksize=None, columns=None):
+        '''
+        Returns an iterator over the record batches of a Parquet or Arrow IPC
+        file, chunksize rows at a time if given. Parquet files are streamed
+        a row group at a time. Arrow files are memory mapped, so slicing them
+        into chunks doesn't copy any data.
+        '''
+        import pyarrow as pa
+        if self._file_format(file) == 'parquet':
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(file)
+            if chunksize:
+                yield from parquet_file.iter_batches(batch_size=chunksize, columns=columns)
+            else:
+                for i in range(parquet_file.num_row_groups):
+                    yield parquet_file.read_row_group(i, columns=columns)
+            return
+        import pyarrow.ipc as ipc
+        with pa.memory_map(str(file)) as source:
+            # Feather v2 is the Arrow IPC file format. Files written in the
+            # streaming format have no footer and are read sequentially.
+            try:
+                reader = ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                batches = ipc.open_stream(source)
+            for batch in batches:
+                if columns:
+                    batch = batch.select(columns)
+                if not chunksize:
+                    yield batch
+                    continue
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(offset, chunksize)
+
+    def _dtypes(self):
+        # Returns dtype_dic with PostgreSQL's names for the types it names
+        # differently.
+        if self.engine is not None and self.engine.dialect.name == 'postgresql':
+            names = {'DOUBLE': 'DOUBLE PRECISION', 'DATETIME': 'TIMESTAMP', 'TINYINT': 'SMALLINT'}
+            return {k: names.get(v, v) for k, v in self.dtype_dic.items()}
+        return self.dtype_dic
+
+    def _arrow_dtypes(self, file, columns=None):
+        '''
+        Maps the Arrow schema of a Parquet or Arrow IPC file to SQL datatypes.
+        Only the string columns are read, to size their VARCHARs. Returns a
+        dictionary of column: SQL datatype.
+        '''
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        from math import ceil
+        if self._file_format(file) == 'parquet':
+            import pyarrow.parquet as pq
+            schema = pq.read_schema(file)
+        else:
+            batch = next(self._arrow_batches(file), None)
+            schema = batch.schema if batch is not None else pa.schema([])
+        if columns:
+            schema = pa.schema([schema.field(c) for c in columns])
+        postgre = self.engine is not None and self.engine.dialect.name == 'postgresql'
+        int_types = {
+            8: 'SMALLINT' if postgre else 'TINYINT',
+            16: 'SMALLINT',
+            32: 'INT',
+            64: 'BIGINT',
+        }
+        dtypes = self._dtypes()
+        sql_dtypes = {}
+        strings = []
+        for field in schema:
+            t = field.type
+            if pa.types.is_dictionary(t):
+                t = t.value_type
+            if pa.types.is_boolean(t):
+                sql_dtype = dtypes['bool']
+            elif pa.types.is_signed_integer(t):
+                sql_dtype = int_types[t.bit_width]
+            elif pa.types.is_unsigned_integer(t):
+                # Unsigned values need the next wider signed type.
+                sql_dtype = int_types.get(t.bit_width * 2, 'DECIMAL(20, 0)')
+            elif pa.types.is_floating(t):
+                sql_dtype = dtypes['float64'] if t.bit_width == 64 else 'REAL'
+            elif pa.types.is_decimal(t):
+                sql_dtype = f'DECIMAL({t.precision}, {t.scale})'
+            elif pa.types.is_date(t):
+                sql_dtype = 'DATE'
+            elif pa.types.is_timestamp(t):
+                sql_dtype = dtypes['datetime64']
+            elif pa.types.is_time(t):
+                sql_dtype = 'TIME'
+            elif pa.types.is_string(t) or pa.types.is_large_string(t):
+                strings.append(field.name)
+                continue
+            else:
+                sql_dtype = 'TEXT'
+            sql_dtypes[field.name] = sql_dtype
+        lengths = dict.fromkeys(strings, 0)
+        if strings:
+            for batch in self._arrow_batches(file, columns=strings):
+                for col in strings:
+                    values = batch.column(col)
+                    if pa.types.is_dictionary(values.type):
+                        values = values.cast(values.type.value_type)
+                    longest = pc.max(pc.utf8_length(values)).as_py()
+                    lengths[col] = max(lengths[col], longest or 0)
+        for col, length in lengths.items():
+            sql_dtypes[col] = f'VARCHAR({max(ceil(length / 50) * 50, 50)})'
+        # Restores the column order of the schema.
+        return {field.name: sql_dtypes[field.name] for field in schema}
+
+    def csv_table(self, file, table=None, pkey=None, nrows=100000, infer='head', clean_colnames=False, printable=False, **kwargs):
         '''
         Creates an empty table based on data from a file. Normally unnecessary
         as pandas .to_sql() creates the table automatically, but could be
         useful when that doesn't work.
         params:
-            file        file the table datatypes will be based on.
+            file        file the table datatypes will be based on. The
+                        datatypes of Parquet and Arrow files are taken from
+                        their schema. gzip, bz2, zstd and xz compressed csv
+                        files are decompressed as they are read.
             table       if None, table = filename.
             pkeys       the table names to pass on when defining the PRIMARY
                         KEYs of the table. If a list is passed, a composite
@@ -191,32 +1792,78 @@ class CZ:
             nrows       determines the number of rows read by pandas when
                         imputing the table datatypes. A large value results in
                         unnecessary data being read. A small value may result
-                        in incorrect table datatype values.
+                        in incorrect table datatype values. When
+                        infer='sample', it is the size of the sample.
+            infer       'head' imputes datatypes from the first nrows rows.
+                        'scan' streams the whole file once and keeps running
+                        column statistics, so late wide strings or floats
+                        are accounted for. 'sample' does the same on a
+                        reservoir sample of nrows rows drawn from the whole
+                        file, but still measures string lengths on every
+                        row. Both pick the narrowest fitting type among
+                        BOOLEAN, TINYINT, SMALLINT, INT, BIGINT, DECIMAL,
+                        DOUBLE, DATE, DATETIME and VARCHAR, and store the
+                        statistics behind each choice as a DataFrame in
+                        self.inference_report.
+            clean_colnames  cleans the column names as described in
+                        csv_clean_colnames without rewriting the file.
             printable   returns the SQL command that would have been executed
                         as a printable string.
             **kwargs    Other arguments to be passed on to pandas read_csv.
         '''
-        import pandas as pd
-        from pathlib import Path
-        from math import ceil
         from sqlalchemy.exc import InternalError
-        # pandas is used to impute datatypes.
-        df = pd.read_csv(file, nrows=nrows, **kwargs)
-        tab = ' ' * self.tabspace
         # The file name will be used as the table name if not provided.
         if table is None:
-            table = Path(file).stem
+            table = self._file_stem(file)
+        if self._file_format(file) != 'csv':
+            # Parquet and Arrow files carry their own schema.
+            sql_dtypes = self._arrow_dtypes(file, columns=kwargs.get('usecols'))
+            if clean_colnames:
+                sql_dtypes = dict(zip(self._clean_colnames(sql_dtypes), sql_dtypes.values()))
+            command = self._table_command(None, table, pkey=pkey, sql_dtypes=sql_dtypes)
+        elif infer == 'head':
+            # pandas is used to impute datatypes.
+            df = next(self._read_chunks(file, nrows=nrows, clean_colnames=clean_colnames, **kwargs))
+            command = self._table_command(df, table, pkey=pkey)
+        else:
+            # Everything is read as text so the values can be checked
+            # against each candidate type.
+            kwargs['dtype'] = str
+            reader = self._read_chunks(file, chunksize=100000, clean_colnames=clean_colnames, **kwargs)
+            sample = nrows if infer == 'sample' else None
+            sql_dtypes, self.inference_report = self._scan_dtypes(reader, sample=sample)
+            command = self._table_command(None, table, pkey=pkey, sql_dtypes=sql_dtypes)
+        if self.database:
+            table = self.database + '.' + table
+        if printable or self.engine is None:
+            return command
+        try:
+            self._execute(command)
+            self._refresh_catalog(table)
+            return f'table {table} created.'
+        except InternalError as err:
+            return err
+
+    def _table_command(self, df, table, pkey=None, sql_dtypes=None):
+        '''
+        Returns the CREATE TABLE command for a table whose datatypes are
+        imputed from a DataFrame, or given as a dictionary of column: SQL
+        datatype.
+        '''
+        from math import ceil
+        tab = ' ' * self.tabspace
         if self.database:
             table = self.database + '.' + table
 
         def get_sql_dtypes(df):
             sql_dtype_dict = {}
+            dtypes = self._dtypes()
             df_dtypes = [x for x in df.dtypes.apply(lambda x: x.name)]
             df = df.fillna('')
             # pandas dtypes are converted to sql dtypes to create the table.
             for i, col in enumerate(df.columns):
-                if df_dtypes[i] in self.dtype_dic:
-                    sql_dtype_dict[col] = self.dtype_dic[df_dtypes[i]]
+                if df_dtypes[i] in dtypes:
+                    sql_dtype_dict[col] = dtypes[df_dtypes[i]]
                 else:
                     # Determine VARCHAR length.
                     char_length = ceil(df[col].map(len).max() / 50) * 50
@@ -224,7 +1871,7 @@ class CZ:
             return sql_dtype_dict
 
         command = f'CREATE TABLE {table}(\n{tab}'
-        sql_dtype_dict = get_sql_dtypes(df)
+        sql_dtype_dict = sql_dtypes if sql_dtypes else get_sql_dtypes(df)
         for col, sql_dtype in sql_dtype_dict.items():
             command = command + f'{col} {sql_dtype}\n{tab},'
         if pkey:
@@ -233,19 +1880,193 @@ class CZ:
             pkey = ', '.join(pkey)
             command += f'PRIMARY KEY({pkey})\n{tab},'
         command = command[:-(self.tabspace+1)] + ');'
-        if printable or self.engine is None:
-            return command
-        try:
-            self.engine.connect().execute(command)
-            return f'table {table} created.'
-        except InternalError as err:
-            return err
+        return command
 
-    def csv_insert(self, file, table=None, pkey=None, postgre=False, chunksize=None, sizelim=1073741824, printable=False, **kwargs):
+    def _scan_dtypes(self, reader, sample=None):
+        '''
+        Imputes SQL datatypes from chunks of text read by reader. Every
+        column starts out as a candidate for every type and candidates are
+        struck off as values that don't fit them are seen. If sample is
+        given, the types are checked on a reservoir sample of that many rows
+        instead of on every row. Returns a dictionary of column: SQL datatype
+        and a report DataFrame.
+        '''
+        import numpy as np
+        import pandas as pd
+        from math import ceil
+        int_ranges = [
+            ('TINYINT', 127),
+            ('SMALLINT', 32767),
+            ('INT', 2147483647),
+            ('BIGINT', 9223372036854775807),
+        ]
+        stats = {}
+        reservoir = None
+        seen = 0
+        rng = np.random.default_rng()
+
+        def new_stats():
+            return {
+                'rows': 0, 'nulls': 0, 'max_len': 0, 'checked': 0,
+                'bool': True, 'int': True, 'decimal': True, 'float': True,
+                'date': True, 'datetime': True,
+                'min': None, 'max': None, 'digits': 0, 'scale': 0,
+            }
+
+        def check_types(col, values):
+            st = stats[col]
+            values = values.dropna().str.strip()
+            if values.empty:
+                return
+            st['checked'] += len(values)
+            if st['bool']:
+                st['bool'] = values.str.lower().isin(['true', 'false']).all()
+            if st['int']:
+                # Anything over 18 digits might not fit in a BIGINT.
+                st['int'] = (values.str.fullmatch(r'[+-]?\d{1,18}')).all()
+                if st['int']:
+                    ints = values.astype('int64')
+                    st['min'] = ints.min() if st['min'] is None else min(st['min'], ints.min())
+                    st['max'] = ints.max() if st['max'] is None else max(st['max'], ints.max())
+            if st['decimal']:
+                parts = values.str.extract(r'^[+-]?(?=\.?\d)(\d*)(?:\.(\d*))?$')
+                st['decimal'] = parts[0].notna().all()
+                if st['decimal']:
+                    st['digits'] = max(st['digits'], parts[0].str.lstrip('0').str.len().max())
+                    st['scale'] = max(st['scale'], parts[1].fillna('').str.len().max())
+            if st['float']:
+                st['float'] = pd.to_numeric(values, errors='coerce').notna().all()
+            if st['date']:
+                st['date'] = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce').notna().all()
+            if st['datetime'] and not st['date']:
+                st['datetime'] = pd.to_datetime(values, format='ISO8601', errors='coerce').notna().all()
+
+        for chunk in reader:
+            for col in chunk.columns:
+                if col not in stats:
+                    stats[col] = new_stats()
+                st = stats[col]
+                values = chunk[col]
+                st['rows'] += len(values)
+                st['nulls'] += int(values.isna().sum())
+                lengths = values.dropna().str.len()
+                if not lengths.empty:
+                    st['max_len'] = max(st['max_len'], int(lengths.max()))
+                if sample is None:
+                    check_types(col, values)
+            if sample is not None:
+                # Algorithm R: row i of the file replaces a random slot of
+                # the reservoir with probability sample / (i + 1).
+                chunk = chunk.reset_index(drop=True)
+                if reservoir is None:
+                    reservoir = chunk.iloc[:0]
+                fill = max(0, min(sample - len(reservoir), len(chunk)))
+                reservoir = pd.concat([reservoir, chunk.iloc[:fill]], ignore_index=True)
+                rest = chunk.iloc[fill:]
+                if not rest.empty:
+                    positions = np.arange(seen + fill, seen + len(chunk))
+                    slots = (rng.random(len(rest)) * (positions + 1)).astype('int64')
+                    keep = slots < sample
+                    reservoir.iloc[slots[keep]] = rest[keep].to_numpy()
+                seen += len(chunk)
+        if reservoir is not None:
+            for col in reservoir.columns:
+                check_types(col, reservoir[col])
+
+        dtypes = self._dtypes()
+        sql_dtypes = {}
+        report = []
+        for col, st in stats.items():
+            if st['rows'] == st['nulls']:
+                sql_dtype = 'VARCHAR(50)'
+            elif not st['checked']:
+                # The sample held only nulls, so all that is known of the
+                # values is how long they are.
+                sql_dtype = f"VARCHAR({max(ceil(st['max_len'] / 50) * 50, 50)})"
+            elif st['bool']:
+                sql_dtype = 'BOOLEAN'
+            elif st['int']:
+                bound = max(abs(st['min']), abs(st['max']))
+                if sample is not None:
+                    # The sample may have missed the extremes, but no value
+                    # can have more digits than the longest string seen.
+                    bound = max(bound, min(10 ** st['max_len'] - 1, int_ranges[-1][1]))
+                sql_dtype = next(name for name, limit in int_ranges if bound <= limit)
+                # PostgreSQL has no TINYINT.
+                if sql_dtype == 'TINYINT' and self.engine is not None and self.engine.dialect.name == 'postgresql':
+                    sql_dtype = 'SMALLINT'
+            elif st['decimal'] and st['scale'] <= 8 and 0 < st['digits'] + st['scale'] <= 18:
+                # Values with long fractions are most likely floats.
+                digits = st['digits']
+                if sample is not None:
+                    digits = max(digits, st['max_len'])
+                sql_dtype = f"DECIMAL({digits + st['scale']}, {st['scale']})"
+            elif st['float']:
+                sql_dtype = dtypes['float64']
+            elif st['date']:
+                sql_dtype = 'DATE'
+            elif st['datetime']:
+                sql_dtype = dtypes['datetime64']
+            else:
+                char_length = max(ceil(st['max_len'] / 50) * 50, 50)
+                sql_dtype = f'VARCHAR({char_length})'
+            sql_dtypes[col] = sql_dtype
+            report.append({
+                'column': col,
+                'sql_dtype': sql_dtype,
+                'rows': st['rows'],
+                'nulls': st['nulls'],
+                'nullable': st['nulls'] > 0,
+                'max_len': st['max_len'],
+                'min': st['min'],
+                'max': st['max'],
+            })
+        return sql_dtypes, pd.DataFrame(report)
+
+    def _has_table(self, table):
+        from sqlalchemy import inspect
+        with self._connection() as con:
+            return inspect(con).has_table(table, schema=self.database)
+
+    def _create_from_chunks(self, reader, table, pkey=None, nrows=100000):
+        '''
+        Creates table, if it doesn't exist, from the datatypes of the first
+        chunks of reader, reading chunks until at least nrows rows have been
+        seen. Returns an iterator over every chunk, including the ones
+        already read, so the file only has to be parsed once.
+        '''
+        import itertools
+        import pandas as pd
+        reader = iter(reader)
+        if self._has_table(table):
+            return reader
+        head = []
+        seen = 0
+        for chunk in reader:
+            head.append(chunk)
+            seen += len(chunk)
+            if seen >= nrows:
+                break
+        if head:
+            self._execute(self._table_command(pd.concat(head), table, pkey=pkey))
+            self._refresh_catalog(table)
+        return itertools.chain(head, reader)
+
+    def csv_insert(self, file, table=None, pkey=None, postgre=False, chunksize=None, sizelim=1073741824, method=None, batch_size=None, nrows=100000, infer='head', clean_colnames=False, checkpoint=None, resume=False, upsert=None, quarantine=None, defer_keys=False, indexes=None, disable_checks=False, pipeline=False, writers=1, queue_size=2, memory_budget=None, printable=False, **kwargs):
         '''
         Convenience function that uploads file data into a database.
         params:
-            file        path of file to be uploaded.
+            file        path of file to be uploaded. Parquet (.parquet, .pq)
+                        and Feather/Arrow IPC (.feather, .arrow) files are
+                        read with pyarrow, anything else as csv. Compressed
+                        csv files (.csv.gz, .csv.bz2, .csv.zst, .csv.xz)
+                        are decompressed as they are read rather than onto
+                        disk. The compression is detected from the file's
+                        first bytes. file can also be a readable stream of
+                        csv, such as an S3 object's body, which is always
+                        read in chunks. table must then be given, and
+                        compression if it is compressed. Streams can't be
+                        checkpointed, loaded natively or scanned by infer.
             pkey        given the table's PRIMARY KEY, the function updates all
                         values in the table with those from the file except the
                         primary key. If a new table is created, pkey is
@@ -261,78 +2082,192 @@ class CZ:
                         being returned for printing.
             sizelim     determines the file size, in bytes, before a default
                         chunksize of 10000 is imposed if chunksize is not
-                        already specified.
+                        already specified. The size of a compressed file is
+                        estimated as it would be once decompressed.
+            method      if 'native', the server's own bulk loader is used
+                        instead of pandas to_sql. That is LOAD DATA LOCAL
+                        INFILE on MySQL/MariaDB (the engine must be created
+                        with connect_args={'local_infile': True}), COPY FROM
+                        STDIN on PostgreSQL and a single executemany
+                        transaction on anything else, such as SQLite. The
+                        file is streamed as is when neither chunksize nor
+                        **kwargs are given, otherwise chunk by chunk.
+            batch_size  the number of rows bound into each executemany call
+                        when to_sql fails and the batched insert takes over.
+                        If None, it is sized to fit within half of the
+                        server's max_allowed_packet.
+            nrows       when the table has to be created, the minimum number
+                        of leading rows its datatypes are imputed from. The
+                        chunks read for this are inserted afterwards rather
+                        than read again.
+            infer       how the datatypes of a new table are imputed. See
+                        csv_table. Anything but 'head' costs an extra pass
+                        over the file before loading.
+            clean_colnames  cleans the column names as described in
+                        csv_clean_colnames as the data is read, leaving the
+                        file untouched.
+            checkpoint  path of a json manifest recording the file's size and
+                        modified time, the next chunk's index and byte offset
+                        and the number of rows committed. It is rewritten
+                        after every chunk, each of which is committed on its
+                        own. If True, the manifest is saved next to the file
+                        as file.checkpoint.json. Implies chunksize=100000 if
+                        no chunksize is given. Not available with
+                        method='native' or inside an open session.
+            resume      if True, a load that was interrupted picks up from
+                        the first uncommitted chunk recorded in the
+                        checkpoint. csv files are seeked straight to its byte
+                        offset. The manifest is ignored if the file has
+                        changed since it was written.
+            upsert      if 'staging' and pkey is given, each chunk is bulk
+                        loaded into a temporary staging table and merged
+                        into table with a single INSERT ... SELECT that
+                        updates existing primary keys, rather than relying
+                        on row by row fallbacks. The table is created first
+                        if it doesn't exist.
+            quarantine  csv file (if it ends in .csv) or table that rows the
+                        database rejects are written to, along with the
+                        error message. When pandas to_sql fails on a chunk,
+                        the chunk is bisected so everything else still goes
+                        in bulk. Rejected rows are counted in the returned
+                        message whether or not quarantine is given.
+            defer_keys  if True, a new table is created without its PRIMARY
+                        KEY, which is only built once every chunk has been
+                        loaded so it isn't maintained on every insert. As
+                        there is no key during the load, pkey no longer
+                        updates existing rows. Not available with upsert.
+            indexes     columns, or lists of columns for composite indexes,
+                        to build indexes on after the data is loaded.
+            disable_checks  if True, unique and foreign key checks are turned
+                        off for the duration of the load and turned back on
+                        afterwards. On PostgreSQL and SQLite, deferrable
+                        constraints are deferred to the end of each
+                        transaction instead.
+            pipeline    if True, chunks are parsed by a reader thread into a
+                        queue and inserted by writer threads at the same
+                        time, so parsing and database time overlap. The time
+                        spent by each stage, and waiting on the other, is
+                        stored in self.load_stats.
+            writers     the number of writer threads. Beyond one, each writer
+                        holds its own connection, so it can't be used inside
+                        an open session or with checkpoint.
+            queue_size  the number of parsed chunks that may wait in the
+                        queue. The reader blocks when it is full, which
+                        bounds memory to queue_size + writers + 1 chunks.
+            memory_budget  roughly how much memory the chunks being loaded
+                        may take up, such as '512MB', in place of a fixed
+                        chunksize or sizelim. The bytes per row are measured
+                        from each chunk read and the next is sized to fit,
+                        so wide files get fewer rows per chunk than narrow
+                        ones. Insert batches are also held to it as well as
+                        to max_allowed_packet. Ignored if chunksize is given
+                        or with method='native'.
             printable   returns the SQL command that would have been executed
                         as a printable string. It doesn't work well past a few
                         thousand rows or so.
             **kwargs    Other arguments to be passed on to pandas read_csv.
         '''
-        from pathlib import Path
         from re import sub
+        from contextlib import nullcontext
+        from sqlalchemy.exc import DataError
         from sqlalchemy.exc import InternalError
         from sqlalchemy.exc import IntegrityError
-        import pandas as pd
+        # A stream, such as an S3 object's body, can only be read once.
+        stream = hasattr(file, 'read')
+        if stream and (table is None or infer != 'head' or method == 'native' or checkpoint or resume):
+            raise ValueError('streams need a table and cannot be scanned, loaded natively or checkpointed.')
         if table is None:
-            table = Path(file).stem
-        # Automatically set chunksize if file exceeds sizelim.
-        if Path(file).stat().st_size >= sizelim and chunksize is None:
+            table = self._file_stem(file)
+        budget = None
+        if memory_budget is not None and chunksize is None:
+            # The budget is split between every chunk held at once, and
+            # halved again for the copy of each chunk made while inserting.
+            held = queue_size + writers + 1 if pipeline else 1
+            budget = self._parse_size(memory_budget) // held // 2
+        # Automatically set chunksize if file exceeds sizelim. The size of a
+        # stream isn't known, so it is always read in chunks.
+        if chunksize is None and budget is None and (stream or self._data_size(file) >= sizelim):
             chunksize = 100000
+        staging = upsert == 'staging' and pkey and not printable
+        if staging and defer_keys:
+            raise ValueError('upserts need the primary key in place, so it cannot be deferred.')
+        # The key is left out while loading if it is to be built afterwards.
+        load_pkey = None if defer_keys else pkey
+        # Parallel writers would race each other to create the table.
+        parallel = pipeline and writers > 1 and not printable
+        creates_table = self.database or method == 'native' or staging or parallel
+        # A table that pandas creates has no primary key, so it is added
+        # once the data is in.
+        to_sql_creates = pkey and not creates_table and not printable and not self._has_table(table)
+        end_pkey = pkey if defer_keys or to_sql_creates else None
+        # Types that can't be inferred from the first chunks are settled by
+        # csv_table beforehand.
+        precreate = infer != 'head' or self._file_format(file) != 'csv'
+        if precreate and creates_table and not printable and not self._has_table(table):
+            self.csv_table(file, table=table, pkey=load_pkey, nrows=nrows, infer=infer, clean_colnames=clean_colnames, **kwargs)
+        if method == 'native' and not printable:
+            with self._without_checks() if disable_checks else nullcontext():
+                message = self._native_insert(file, table=table, pkey=load_pkey, chunksize=chunksize, batch_size=batch_size, nrows=nrows, clean_colnames=clean_colnames, **kwargs)
+            self._invalidate(table)
+            message += self._add_keys(self.database + '.' + table if self.database else table, pkey=end_pkey, indexes=indexes)
+            self._refresh_catalog(table)
+            return message
+        manifest = None
+        if (checkpoint or resume) and not printable:
+            if self._con is not None:
+                raise ValueError('checkpointed loads commit every chunk and cannot run inside a session.')
+            if checkpoint in (None, True):
+                checkpoint = str(file) + '.checkpoint.json'
+            if chunksize is None and budget is None:
+                chunksize = 100000
+            # Chunks sized by a budget can only be resumed with the same one.
+            manifest = self._load_checkpoint(checkpoint, file, table, chunksize or budget, resume=resume)
+            if manifest['complete']:
+                return f"data already loaded into table {table}, {manifest['rows']} rows."
+            reader = self._read_chunks(file, chunksize=chunksize, clean_colnames=clean_colnames,
+                                       skip=manifest['chunk'], offset=manifest['offset'], budget=budget, **kwargs)
+        else:
+            reader = self._read_chunks(file, chunksize=chunksize, clean_colnames=clean_colnames, budget=budget, **kwargs)
+        if creates_table and not printable:
+            reader = self._create_from_chunks(reader, table, pkey=load_pkey, nrows=nrows)
         if self.database:
-            self.csv_table(file, table=table, pkey=pkey)
             table = self.database + '.' + table
 
-        def individual_insert(df, table=None):
-            rows = [x for x in df.itertuples(index=False, name=None)]
-            cols = ', '.join(df.columns)
-            tab = ' ' * self.tabspace
-            for r in rows:
-                command = f'INSERT INTO {table}({cols}) VALUES '
-                # Fix null values.
-                pattern = r"([^\w'])nan([^\w'])"
-                replacement = r'\1NULL\2'
-                fixed_r = sub(pattern, replacement, f'{r}')
-                command += f'{fixed_r}\n'
-                if pkey:
-                    if postgre:
-                        command = command[:-(self.tabspace+1)] + \
-                            f'ON CONFLICT ({pkey}) DO UPDATE SET\n{tab}'
-                        for c in df.columns:
-                            if c != pkey:
-                                command += f'{c}=excluded.{c}\n{tab},'
-                    else:
-                        command += f'ON DUPLICATE KEY UPDATE\n{tab}'
-                        for c in df.columns:
-                            if c not in pkey:
-                                command += f'{c}=VALUES({c})\n{tab},'
-                    command = command[:-(self.tabspace+1)] + ';'
-                try:
-                    self.engine.connect().execute(command)
-                except (InternalError, IntegrityError):
-                    continue
+        rejected = []
 
-        def alchemy_insert(df, pkey=None, table=None):
+        def alchemy_insert(df, pkey=None, table=None, cz=self):
+            rows = batch_size
+            if budget and rows is None:
+                rows = cz._batch_rows(df, limit=budget)
+            if staging:
+                cz._staging_upsert(df, table, pkey, postgre=postgre, batch_size=rows)
+                return
             try:
-                df.to_sql(table, self.engine, index=False, if_exists='append')
-            except (InternalError, IntegrityError):
-                individual_insert(df, table=table)
-            if pkey:
-                try:
-                    command = f'ALTER TABLE {table} ADD PRIMARY KEY({pkey});'
-                    self.engine.connect().execute(command)
-                except InternalError as err:
-                    return err
+                # pandas expects the database as schema rather than as part
+                # of the table name.
+                schema, _, name = table.rpartition('.')
+                # The savepoint lets the fallback carry on inside a session.
+                with cz._connection() as con, con.begin_nested():
+                    df.to_sql(name, con, schema=schema or None, index=False, if_exists='append', chunksize=rows if budget else None)
+            except (DataError, InternalError, IntegrityError):
+                rejects = []
+                cz._batch_insert(df, table, pkey=pkey, postgre=postgre, batch_size=rows,
+                                 skip_errors=True, rejects=rejects)
+                if rejects and quarantine:
+                    cz._quarantine(rejects, quarantine)
+                rejected.append(len(rejects))
 
         def mass_insert(df, table=None, pkey=None, postgre=False):
             rows = [x for x in df.itertuples(index=False, name=None)]
             cols = ', '.join(df.columns)
             tab = ' ' * self.tabspace
+            # Fix null values. The rows are joined once at the end as
+            # repeated string concatenation is quadratic in chunk size.
+            pattern = r"([^\w'])nan([^\w'])"
+            replacement = r'\1NULL\2'
+            values = [sub(pattern, replacement, f'{r}') for r in rows]
             command = f'INSERT INTO {table}({cols})\nVALUES\n{tab}'
-            for r in rows:
-                # Fix null values.
-                pattern = r"([^\w'])nan([^\w'])"
-                replacement = r'\1NULL\2'
-                fixed_r = sub(pattern, replacement, f'{r}')
-                command += f'{fixed_r}\n{tab},'
+            command += f'\n{tab},'.join(values) + f'\n{tab},'
             if pkey:
                 if postgre:
                     command = command[:-(self.tabspace+1)] + \
@@ -349,40 +2284,569 @@ class CZ:
             command = command[:-(self.tabspace+1)] + ';\n'
             return command
 
-        if chunksize:
-            reader = pd.read_csv(file, chunksize=chunksize, **kwargs)
-            for chunk in reader:
-                df = pd.DataFrame(chunk)
-                if printable:
+        def loaded():
+            message = f'data loaded into table {table}.'
+            if sum(rejected):
+                message += f' {sum(rejected)} rows rejected'
+                message += f', quarantined in {quarantine}.' if quarantine else '.'
+            return message
+
+        if printable:
+            if chunksize or budget:
+                for df in reader:
                     with open('chunk_insert.txt', 'a') as f:
                         f.write(mass_insert(df, pkey=pkey,
                                             postgre=postgre, table=table))
-                else:
-                    alchemy_insert(df, pkey=pkey, table=table)
-            if printable:
                 return 'sql commands written to chunk_insert.txt'
+            # Only Parquet and Arrow files come in more than one piece here.
+            return ''.join(mass_insert(df, pkey=pkey, postgre=postgre, table=table) for df in reader)
+
+        def write(df, cz):
+            # Cached results are dropped as soon as the table changes.
+            if manifest is None:
+                alchemy_insert(df, pkey=load_pkey, table=table, cz=cz)
+                cz._invalidate(table)
+                return
+            before = sum(rejected)
+            # The manifest only moves on once the chunk is committed.
+            with cz._without_checks() if disable_checks else cz.session():
+                alchemy_insert(df, pkey=load_pkey, table=table, cz=cz)
+            cz._invalidate(table)
+            manifest['chunk'] += 1
+            manifest['offset'] = df.attrs.get('offset')
+            manifest['rows'] += len(df) - (sum(rejected) - before)
+            self._save_checkpoint(checkpoint, manifest)
+
+        def scope(cz):
+            # Checks stay off for the whole load unless every chunk is
+            # committed on its own.
+            if disable_checks and manifest is None:
+                return cz._without_checks()
+            return nullcontext()
+
+        if pipeline:
+            if writers > 1 and (manifest is not None or self._con is not None):
+                raise ValueError('parallel writers commit out of order and cannot be checkpointed or share a session.')
+            self.load_stats = self._pipeline(reader, write, scope, writers=writers, queue_size=queue_size)
+        else:
+            with scope(self):
+                for df in reader:
+                    write(df, self)
+        if manifest is not None:
+            manifest['complete'] = True
+            self._save_checkpoint(checkpoint, manifest)
+        message = loaded() + self._add_keys(table, pkey=end_pkey, indexes=indexes)
+        # Covers tables pandas created and keys added after the load.
+        self._refresh_catalog(table)
+        return message
+
+    def _pipeline(self, reader, write, scope, writers=1, queue_size=2):
+        '''
+        Runs reader in a thread that parses chunks into a bounded queue while
+        writers call write(df, cz) on them, each inside scope(cz). A single
+        writer uses this CZ on the calling thread, so an open session's
+        connection stays on the thread it was opened in. Otherwise each
+        writer gets its own CZ and thread. Returns the seconds spent parsing,
+        inserting and waiting on either side.
+        '''
+        import queue
+        import threading
+        import time
+        chunks = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        lock = threading.Lock()
+        done = object()
+        errors = []
+        stats = {
+            'chunks': 0,
+            'rows': 0,
+            'parse': 0.0,
+            'parse_wait': 0.0,
+            'insert': [0.0] * writers,
+            'insert_wait': [0.0] * writers,
+        }
+
+        def put(item):
+            # Gives up if a writer has failed, rather than block forever.
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def produce():
+            try:
+                chunk_iter = iter(reader)
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    df = next(chunk_iter, done)
+                    stats['parse'] += time.perf_counter() - start
+                    if df is done:
+                        break
+                    start = time.perf_counter()
+                    put(df)
+                    stats['parse_wait'] += time.perf_counter() - start
+            except BaseException as err:
+                errors.append(err)
+                stop.set()
+            finally:
+                for _ in range(writers):
+                    put(done)
+
+        def consume(i, cz):
+            try:
+                with scope(cz):
+                    while not stop.is_set():
+                        start = time.perf_counter()
+                        try:
+                            df = chunks.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+                        finally:
+                            stats['insert_wait'][i] += time.perf_counter() - start
+                        if df is done:
+                            break
+                        start = time.perf_counter()
+                        write(df, cz)
+                        stats['insert'][i] += time.perf_counter() - start
+                        with lock:
+                            stats['chunks'] += 1
+                            stats['rows'] += len(df)
+            except BaseException as err:
+                errors.append(err)
+                stop.set()
+
+        threads = [threading.Thread(target=produce)]
+        if writers > 1:
+            threads += [threading.Thread(target=consume, args=(i, self._worker()))
+                        for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        if writers == 1:
+            consume(0, self)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        # The stage that is busy for longer holds the load back. Writers
+        # share the inserts between them.
+        insert = sum(stats['insert']) / writers
+        stats['bottleneck'] = 'insert' if insert > stats['parse'] else 'parse'
+        return stats
+
+    def _worker(self):
+        # Returns a copy of this CZ for another thread, so sessions aren't
+        # shared between threads.
+        import copy
+        cz = copy.copy(self)
+        cz._con = None
+        return cz
+
+    def _native_insert(self, file, table, pkey=None, chunksize=None, batch_size=None, nrows=100000, clean_colnames=False, **kwargs):
+        '''
+        Loads a file with the bulk loader native to the engine's dialect.
+        Called by csv_insert when method='native'. Returns the number of rows
+        loaded and the load rate.
+        '''
+        import csv
+        import io
+        import os
+        import tempfile
+        import time
+        from pathlib import Path
+        start = time.perf_counter()
+        dialect = self.engine.dialect.name
+        name = table
+        if self.database:
+            table = self.database + '.' + table
+
+        def mysql_load(path, cols):
+            # Empty fields are read into variables so they can be set to NULL
+            # instead of being coerced into '' or 0.
+            variables = ', '.join(f'@v{i}' for i in range(len(cols)))
+            assignments = ', '.join(
+                f"{c} = NULLIF(@v{i}, '')" for i, c in enumerate(cols))
+            path = Path(path).resolve().as_posix()
+            replace = ' REPLACE' if pkey else ''
+            command = (
+                f"LOAD DATA LOCAL INFILE '{path}'{replace} INTO TABLE {table}\n"
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'\n"
+                "LINES TERMINATED BY '\\n'\n"
+                f'IGNORE 1 LINES ({variables})\n'
+                f'SET {assignments};'
+            )
+            return self._execute(command).rowcount
+
+        def postgres_copy(f, cols):
+            command = f"COPY {table}({', '.join(cols)}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+            if self._con is not None:
+                # Copied inside the open session's transaction.
+                cursor = self._con.connection.cursor()
+                cursor.copy_expert(command, f)
+                return cursor.rowcount
+            con = self.engine.raw_connection()
+            try:
+                cursor = con.cursor()
+                cursor.copy_expert(command, f)
+                rows = cursor.rowcount
+                con.commit()
+            finally:
+                con.close()
+            return rows
+
+        def load_df(df, con=None):
+            cols = list(df.columns)
+            if dialect == 'mysql':
+                # LOAD DATA only reads from files, so each chunk is spooled
+                # into a temporary one.
+                fd, path = tempfile.mkstemp(suffix='.csv')
+                os.close(fd)
+                try:
+                    df.to_csv(path, index=False, lineterminator='\n')
+                    return mysql_load(path, cols)
+                finally:
+                    os.remove(path)
+            if dialect == 'postgresql':
+                buffer = io.StringIO()
+                df.to_csv(buffer, index=False)
+                buffer.seek(0)
+                return postgres_copy(buffer, cols)
+            # Generic fallback: every row is bound as a parameter and sent
+            # with executemany inside the caller's transaction.
+            return self._batch_insert(df, table, pkey=pkey, batch_size=batch_size, con=con)
+
+        rows = 0
+        streamable = chunksize is None and not kwargs and dialect in ('mysql', 'postgresql') and self._file_format(file) == 'csv'
+        # LOAD DATA can only read the file as it is on disk.
+        if dialect == 'mysql' and self._compression(file):
+            streamable = False
+        if streamable:
+            # The bulk loaders need the table to exist beforehand.
+            if not self._has_table(name):
+                self.csv_table(file, table=name, pkey=pkey, nrows=nrows, clean_colnames=clean_colnames)
+            # The file is handed to the server without being parsed locally.
+            # Cleaned column names only need to appear in the column list.
+            with io.TextIOWrapper(self._open(file), newline='') as f:
+                cols = next(csv.reader(f))
+                if clean_colnames:
+                    cols = self._clean_colnames(cols)
+                if dialect == 'mysql':
+                    rows = mysql_load(file, cols)
+                else:
+                    f.seek(0)
+                    rows = postgres_copy(f, cols)
+        else:
+            reader = self._read_chunks(file, chunksize=chunksize, clean_colnames=clean_colnames, **kwargs)
+            reader = self._create_from_chunks(reader, name, pkey=pkey, nrows=nrows)
+            if dialect in ('mysql', 'postgresql'):
+                for df in reader:
+                    rows += load_df(df)
+            else:
+                with self.session() as con:
+                    for df in reader:
+                        rows += load_df(df, con=con)
+        elapsed = time.perf_counter() - start
+        rate = rows / elapsed if elapsed else float(rows)
+        return f'{rows} rows loaded into table {table} in {elapsed:.2f}s ({rate:.0f} rows/s).'
+
+    def _max_packet(self):
+        '''
+        Returns the largest statement size in bytes the server accepts. Only
+        MySQL/MariaDB report one, other dialects get a 16MB default.
+        '''
+        if getattr(self, '_packet', None) is None:
+            self._packet = 16777216
+            if self.engine.dialect.name == 'mysql':
+                with self._connection() as con:
+                    self._packet = int(con.execute('SELECT @@max_allowed_packet;').scalar())
+        return self._packet
+
+    def _batch_rows(self, df, limit=None):
+        '''
+        Returns the number of rows of df that fit into a multi-row INSERT no
+        longer than half of max_allowed_packet, or limit bytes if that is
+        smaller. Rows are measured as the VALUES text they are sent as,
+        taken from up to the first 1000 rows.
+        '''
+        target = self._max_packet() // 2
+        if limit:
+            target = min(target, limit)
+        sample = df.head(1000)
+        if sample.empty:
+            return 1
+        text = sum(len(f'{r},') for r in sample.itertuples(index=False, name=None))
+        return max(1, int(target // max(text / len(sample), 1)))
+
+    def _upsert_clause(self, cols, pkey, postgre=False):
+        '''
+        Returns the clause that turns an INSERT into an update of every non
+        primary key column when the primary key already exists.
+        '''
+        if isinstance(pkey, str):
+            pkey = [pkey]
+        tab = ' ' * self.tabspace
+        updates = [c for c in cols if c not in pkey]
+        if postgre or self.engine.dialect.name in ('postgresql', 'sqlite'):
+            clause = f"\nON CONFLICT ({', '.join(pkey)}) DO "
+            if not updates:
+                return clause + 'NOTHING'
+            sets = f'\n{tab},'.join(f'{c}=excluded.{c}' for c in updates)
+            return clause + f'UPDATE SET\n{tab}{sets}'
+        if not updates:
+            updates = pkey
+        sets = f'\n{tab},'.join(f'{c}=VALUES({c})' for c in updates)
+        return f'\nON DUPLICATE KEY UPDATE\n{tab}{sets}'
+
+    def _insert_statement(self, table, cols, pkey=None, postgre=False):
+        '''
+        Returns an INSERT of cols into table, or an upsert that updates every
+        non primary key column if pkey is given. It is built with
+        sqlalchemy's insert() rather than as text, as SQLAlchemy only hands
+        compiled INSERTs to psycopg2's execute_values.
+        '''
+        from sqlalchemy import column, insert
+        from sqlalchemy import table as table_clause
+        schema, _, name = table.rpartition('.')
+        target = table_clause(name, *[column(c) for c in cols], schema=schema or None)
+        if not pkey:
+            return insert(target)
+        if isinstance(pkey, str):
+            pkey = [pkey]
+        updates = [c for c in cols if c not in pkey]
+        dialect = 'postgresql' if postgre else self.engine.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            statement = dialect_insert(target)
+            if not updates:
+                return statement.on_conflict_do_nothing(index_elements=pkey)
+            return statement.on_conflict_do_update(
+                index_elements=pkey, set_={c: statement.excluded[c] for c in updates})
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        statement = dialect_insert(target)
+        return statement.on_duplicate_key_update({c: statement.inserted[c] for c in updates or pkey})
+
+    def _batch_insert(self, df, table, pkey=None, postgre=False, batch_size=None, skip_errors=False, rejects=None, con=None):
+        '''
+        Inserts a DataFrame by binding its values as parameters and sending
+        them batch_size rows at a time with executemany. pymysql and
+        mysqlclient rewrite these into multi-row VALUES statements, and
+        psycopg2 sends them through execute_values, so a batch takes a
+        round trip or a few rather than one per row. The statement stays the
+        same for every batch so the server only parses it once.
+        params:
+            df          DataFrame to be inserted.
+            table       table to insert into.
+            pkey        if given, existing rows with the same PRIMARY KEY are
+                        updated instead.
+            batch_size  rows per executemany call. If None, it is sized so a
+                        batch fits within half of max_allowed_packet. See
+                        _batch_rows.
+            skip_errors if True, a failing batch is split in half and each
+                        half retried, recursively, so the good rows still go
+                        in bulk and only the rows the database rejects on
+                        their own are skipped.
+            rejects     list the skipped rows are appended to, as
+                        dictionaries of column: value with the database's
+                        error message under 'error'.
+            con         connection to execute on. If None, the open session
+                        is used, or failing that each batch is committed in
+                        its own transaction.
+        '''
+        from sqlalchemy.exc import DataError
+        from sqlalchemy.exc import InternalError
+        from sqlalchemy.exc import IntegrityError
+        if df.empty:
+            return 0
+        if con is None:
+            con = self._con
+        cols = list(df.columns)
+        command = self._insert_statement(table, cols, pkey=pkey, postgre=postgre)
+        if batch_size is None:
+            batch_size = self._batch_rows(df)
+        # NaN is converted to None a column at a time so it is bound as NULL.
+        values = [df[c].astype(object).where(df[c].notna(), None).tolist() for c in cols]
+        records = [dict(zip(cols, r)) for r in zip(*values)]
+
+        def execute(batch):
+            if con is None:
+                with self._connection() as c:
+                    c.execute(command, batch)
+            elif skip_errors:
+                # A savepoint keeps a rejected batch from aborting the rest
+                # of the caller's transaction.
+                with con.begin_nested():
+                    con.execute(command, batch)
             else:
-                return f'data loaded into table {table}.'
+                con.execute(command, batch)
 
+        def bisect(batch):
+            try:
+                execute(batch)
+                return len(batch)
+            except (DataError, InternalError, IntegrityError) as err:
+                if not skip_errors:
+                    raise
+                if len(batch) == 1:
+                    if rejects is not None:
+                        reject = dict(batch[0])
+                        reject['error'] = str(getattr(err, 'orig', err))
+                        rejects.append(reject)
+                    return 0
+                half = len(batch) // 2
+                return bisect(batch[:half]) + bisect(batch[half:])
+
+        inserted = 0
+        for i in range(0, len(records), batch_size):
+            inserted += bisect(records[i:i+batch_size])
+        return inserted
+
+    def _quarantine(self, rejects, quarantine):
+        '''
+        Appends rejected rows to quarantine, a csv file if it ends in .csv and
+        a table otherwise.
+        '''
+        import os
+        import pandas as pd
+        df = pd.DataFrame(rejects)
+        if str(quarantine).endswith('.csv'):
+            df.to_csv(quarantine, mode='a', index=False, header=not os.path.exists(quarantine))
+            return
+        schema, _, name = str(quarantine).rpartition('.')
+        with self._connection() as con:
+            df.to_sql(name, con, schema=schema or None, index=False, if_exists='append')
+
+    @contextmanager
+    def _without_checks(self):
+        '''
+        Opens a session with unique and foreign key checks turned off, turning
+        them back on before it closes.
+        '''
+        dialect = self.engine.dialect.name
+        if dialect == 'mysql':
+            off = ['SET unique_checks = 0;', 'SET foreign_key_checks = 0;']
+            on = ['SET unique_checks = 1;', 'SET foreign_key_checks = 1;']
+        elif dialect == 'postgresql':
+            # Only lasts until the end of the transaction.
+            off = ['SET CONSTRAINTS ALL DEFERRED;']
+            on = []
+        else:
+            off = ['PRAGMA defer_foreign_keys = ON;']
+            on = []
+        with self.session() as con:
+            for command in off:
+                con.execute(command)
+            try:
+                yield con
+            finally:
+                for command in on:
+                    con.execute(command)
+
+    def _add_keys(self, table, pkey=None, indexes=None):
+        '''
+        Builds a PRIMARY KEY and indexes on table, typically once it has been
+        loaded. Returns a message listing what was built and what failed.
+        '''
+        from sqlalchemy.exc import DBAPIError
+        dialect = self.engine.dialect.name
+        schema, _, name = table.rpartition('.')
+        commands = {}
+        if pkey:
+            if isinstance(pkey, str):
+                pkey = [pkey]
+            cols = ', '.join(pkey)
+            if dialect == 'sqlite':
+                # SQLite can't add a primary key to an existing table, but a
+                # unique index enforces the same thing.
+                index = f'{schema}.{name}_pkey' if schema else f'{name}_pkey'
+                commands['primary key'] = f'CREATE UNIQUE INDEX {index} ON {name}({cols});'
+            else:
+                commands['primary key'] = f'ALTER TABLE {table} ADD PRIMARY KEY({cols});'
+        if isinstance(indexes, str):
+            indexes = [indexes]
+        for cols in indexes or []:
+            if isinstance(cols, str):
+                cols = [cols]
+            index = f"idx_{name}_{'_'.join(cols)}"
+            target = table
+            # SQLite qualifies the index instead of the table.
+            if dialect == 'sqlite' and schema:
+                index = f'{schema}.{index}'
+                target = name
+            commands[f"index on {', '.join(cols)}"] = f"CREATE INDEX {index} ON {target}({', '.join(cols)});"
+        message = ''
+        for key, command in commands.items():
+            try:
+                self._execute(command)
+                message += f' {key} built.'
+            except DBAPIError as err:
+                message += f' {key} failed: {getattr(err, "orig", err)}.'
+        return message
+
+    def _staging_upsert(self, df, table, pkey, postgre=False, batch_size=None):
+        '''
+        Upserts a DataFrame into table by loading it into a temporary staging
+        table and merging that into table with one INSERT ... SELECT. Rows
+        sharing a primary key within df are reduced to the last one, as they
+        would be if upserted one after another. Returns the number of rows
+        merged.
+        '''
+        if isinstance(pkey, str):
+            pkey = [pkey]
+        df = df.drop_duplicates(subset=pkey, keep='last')
+        cols = ', '.join(df.columns)
+        dialect = self.engine.dialect.name
+        schema, _, name = table.rpartition('.')
+        # Temporary tables live in their own schema on PostgreSQL and
+        # SQLite, but in the current database on MySQL. The staging table is
+        # named through that schema so a real table of the same name is
+        # never dropped or read in its place.
+        stage = f'{name}_staging'
+        if dialect == 'mysql':
+            if schema:
+                stage = f'{schema}.{stage}'
+            create = f'CREATE TEMPORARY TABLE {stage} LIKE {table};'
+            drop = f'DROP TEMPORARY TABLE IF EXISTS {stage};'
+        elif dialect == 'postgresql':
+            create = f'CREATE TEMPORARY TABLE {stage} (LIKE {table} INCLUDING DEFAULTS);'
+            stage = f'pg_temp.{stage}'
+            drop = f'DROP TABLE IF EXISTS {stage};'
         else:
-            df = pd.read_csv(file, **kwargs)
-            if printable:
-                return mass_insert(df, pkey=pkey, postgre=postgre, table=table)
-            alchemy_insert(df, pkey=pkey, table=table)
-            return f'data loaded into table {table}.'
+            create = f'CREATE TEMPORARY TABLE {stage} AS SELECT * FROM {table} WHERE 0;'
+            stage = f'temp.{stage}'
+            drop = f'DROP TABLE IF EXISTS {stage};'
+        # SQLite needs a WHERE clause to tell the upsert apart from a join.
+        where = ' WHERE true' if dialect == 'sqlite' else ''
+        command = f'INSERT INTO {table}({cols})\nSELECT {cols}\nFROM {stage}{where}'
+        command += self._upsert_clause(df.columns, pkey, postgre=postgre) + ';'
+        # Temporary tables are only visible to the connection that made
+        # them, so everything runs in one session.
+        with self.session() as con:
+            con.execute(drop)
+            con.execute(create)
+            self._batch_insert(df, stage, batch_size=batch_size, con=con)
+            con.execute(command)
+            con.execute(drop)
+        return len(df)
 
-    def csvs_into_database(self, file_paths, table=None, clean_colnames=False, pkeys=None, **kwargs):
+    def csvs_into_database(self, file_paths, table=None, clean_colnames=False, pkeys=None, workers=1, **kwargs):
         '''
         Convenience function that uploads a folder of files into a database.
+        Returns a DataFrame summarizing the load of each file.
         params:
             file_paths      a string passed to the glob module which determines
                             what files to to upload. Normally in the format
-                            './folder/*.extension'
+                            './folder/*.extension'. Parquet, Arrow and
+                            compressed csv files can be given as well.
             table       the table to upload the files into. Use when all
                             files are to be uploaded into a SINGLE TABLE.
             clean_colnames  standardizes and gets rid of potentially
-                            problematic characters in column names. Warning:
-                            replaces the column names in the original file.
+                            problematic characters in column names as the
+                            files are read. The files themselves are left
+                            untouched.
             pkeys           accepts a list of PRIMARY KEYs to be assigned to
                             each table to be created. Must be given in file
                             alphabetical order as the files will be read in
@@ -392,52 +2856,139 @@ class CZ:
                             alphabetical on atom can be different from the way
                             python processes the files if _ is in the file
                             name.
+            workers         the number of files loaded concurrently. Each
+                            worker holds its own connection, so this should
+                            not exceed the engine's pool size plus overflow.
+                            Files going into the same table are always loaded
+                            one after another by the same worker.
             **kwargs        optional arguments passed to pandas read_csv
                             function. na_values can be specified,
                             keep_default_na=False, low_memory=False are useful
                             arguments.
         '''
         import glob
+        import pandas as pd
         files = glob.glob(file_paths)
-        has_incomplete_pkeys = False
-        if pkeys:
-            if isinstance(pkeys, str):
-                pkeys = [pkeys]
-            if table:
-                for i, file in enumerate(files):
-                    if clean_colnames:
-                        self.csv_clean_colnames(file)
-                    try:
-                        self.csv_insert(file, table=table,
-                                        pkey=pkeys[i], **kwargs)
-                    except TypeError or IndexError:
-                        has_incomplete_pkeys = True
-                        self.csv_insert(file, table=table, **kwargs)
-            else:
-                for i, file in enumerate(files):
-                    if clean_colnames:
-                        self.csv_clean_colnames(file)
-                    try:
-                        self.csv_insert(file, pkey=pkeys[i], **kwargs)
-                    except TypeError or IndexError:
-                        has_incomplete_pkeys = True
-                        self.csv_insert(file, **kwargs)
-        else:
-            if table:
-                for file in files:
-                    if clean_colnames:
-                        self.csv_clean_colnames(file)
-                    self.csv_insert(file, table=table, **kwargs)
-            else:
-                for file in files:
-                    if clean_colnames:
-                        self.csv_clean_colnames(file)
-                    self.csv_insert(file, **kwargs)
+        if isinstance(pkeys, str):
+            pkeys = [pkeys]
+        if pkeys is None:
+            pkeys = []
+        # Files are grouped by target table so no two workers write into the
+        # same table at once.
+        groups = {}
+        for i, file in enumerate(files):
+            pkey = pkeys[i] if i < len(pkeys) else None
+            target = table if table else self._file_stem(file)
+            groups.setdefault(target, []).append((file, pkey or None))
+
+        def insert(cz, file, target, pkey):
+            return cz.csv_insert(file, table=table, pkey=pkey, clean_colnames=clean_colnames, **kwargs)
+
+        # Checkpointed loads and parallel writers commit as they go.
+        commits = kwargs.get('checkpoint') or kwargs.get('resume') or (kwargs.get('pipeline') and kwargs.get('writers', 1) > 1)
+        records = self._load_groups(groups, insert, workers=workers, label='file', commits=commits)
+        columns = ['file', 'table', 'pkey', 'status', 'seconds', 'message']
+        summary = pd.DataFrame(records, columns=columns)
+        # Restores the order the files were globbed in.
+        summary = summary.set_index('file').loc[files].reset_index()
+        return summary
+
+    def _load_groups(self, groups, insert, workers=1, label='file', commits=False):
+        '''
+        Calls insert(cz, source, target, pkey) on every source in groups, a
+        dictionary of target table: [(source, pkey)], and returns a record of
+        how each went. Each source is committed as a whole in its own session
+        unless commits, when insert commits as it goes, as checkpointed loads
+        and parallel writers do. With more than one worker, tables are loaded
+        concurrently, each by a worker with its own CZ and connection.
+        '''
+        import time
+        from contextlib import nullcontext
+        from concurrent.futures import ThreadPoolExecutor
+
+        def load(target, group, cz):
+            records = []
+            for source, pkey in group:
+                start = time.perf_counter()
+                record = {label: source, 'table': target, 'pkey': pkey}
+                try:
+                    with nullcontext() if commits else cz.session():
+                        result = insert(cz, source, target, pkey)
+                    if isinstance(result, Exception):
+                        raise result
+                    record['status'] = 'loaded'
+                    record['message'] = str(result)
+                except Exception as err:
+                    record['status'] = 'failed'
+                    record['message'] = str(err)
+                record['seconds'] = time.perf_counter() - start
+                records.append(record)
+            return records
+
+        if workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(load, target, group, self._worker())
+                           for target, group in groups.items()]
+                return [r for future in futures for r in future.result()]
+        return [r for target, group in groups.items()
+                for r in load(target, group, self)]
+
+    # bucket is meant to be a boto3 Bucket resource.
+    def s3_insert(self, bucket, keys, table=None, pkeys=None, workers=1, pipeline=True, **kwargs):
+        '''
+        Loads csv objects from S3 into a database without saving them to
+        disk. Each object's body is read in chunks as it downloads and
+        inserted with csv_insert. Returns a DataFrame summarizing the load of
+        each key, as csvs_into_database does.
+        params:
+            bucket      a boto3 Bucket, such as
+                        boto3.resource('s3').Bucket('name').
+            keys        key or list of keys to load, such as those given by
+                        iter_keys. .gz, .bz2, .zst and .xz keys are
+                        decompressed as they are read.
+            table       the table to load every key into. If None, each key
+                        goes into the table named after it.
+            pkeys       PRIMARY KEYs of the tables, in the order of keys. See
+                        csvs_into_database.
+            workers     the number of tables loaded concurrently, each
+                        worker holding its own connection.
+            pipeline    passed on to csv_insert, so the next chunk downloads
+                        while the last is inserted.
+            **kwargs    optional arguments passed to csv_insert and pandas
+                        read_csv.
+        '''
+        import pandas as pd
+        from pathlib import Path
+        if isinstance(keys, str):
+            keys = [keys]
+        keys = list(keys)
+        if isinstance(pkeys, str):
+            pkeys = [pkeys]
+        if pkeys is None:
+            pkeys = []
+        # Clients are thread safe where resources aren't, so one is shared.
+        client = bucket.meta.client
+        groups = {}
+        for i, key in enumerate(keys):
+            pkey = pkeys[i] if i < len(pkeys) else None
+            target = table if table else self._file_stem(key)
+            groups.setdefault(target, []).append((key, pkey or None))
+
+        def insert(cz, key, target, pkey):
+            body = client.get_object(Bucket=bucket.name, Key=key)['Body']
+            options = dict(kwargs)
+            options.setdefault('compression', self.compression_dic.get(Path(key).suffix.lower()))
+            try:
+                return cz.csv_insert(body, table=target, pkey=pkey, pipeline=pipeline, **options)
+            finally:
+                body.close()
 
-        return_statement = f'files written to database {self.current_db()}.'
-        if has_incomplete_pkeys:
-            return_statement = 'not all tables have primary keys.\n' + return_statement
-        return return_statement
+        # Parallel writers commit as they go.
+        commits = pipeline and kwargs.get('writers', 1) > 1
+        records = self._load_groups(groups, insert, workers=workers, label='key', commits=commits)
+        columns = ['key', 'table', 'pkey', 'status', 'seconds', 'message']
+        summary = pd.DataFrame(records, columns=columns)
+        return summary.set_index('key').loc[keys].reset_index()
 
     def show_tables(self, all=False, printable=False):
         if self.database:
@@ -453,7 +3004,13 @@ class CZ:
         if printable or self.engine is None:
             return command
         import pandas as pd
-        df = pd.read_sql_query(command, self.engine)
+        if self.catalog is not None and not all:
+            tables = self.catalog.tables(self, self.database)
+            name = self.catalog.name(self, self.database)
+            # Named as SHOW TABLES names its column.
+            return pd.DataFrame({f'Tables_in_{name}' if name else 'TABLE_NAME': tables})
+        with self._connection() as con:
+            df = pd.read_sql_query(command, con)
         return df
 
     def clone_table(self, target, new_table=None, cols=None, where=None, printable=False):
@@ -478,9 +3035,11 @@ class CZ:
         if printable or self.engine is None:
             return command
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
         except InternalError as err:
             return err
+        self._invalidate(new_table)
+        self._refresh_catalog(new_table)
         return f'table {target} cloned into table {new_table}.'
 
     def del_tables(self, tables, printable=False):
@@ -503,13 +3062,17 @@ class CZ:
         if printable or self.engine is None:
             return command
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
         except InternalError as err:
             return err
+        for table in tables:
+            self._invalidate(table)
+            self._refresh_catalog(table)
         return_string = ', '.join(tables)
         return f'table(s) {return_string} deleted.'
 
     def show_columns(self, table, all=False, printable=False):
+        name = table
         if self.database:
             table = self.database + '.' + table
         if all:
@@ -519,7 +3082,13 @@ class CZ:
         if printable or self.engine is None:
             return command
         import pandas as pd
-        df = pd.read_sql_query(command, self.engine)
+        if self.catalog is not None and not all:
+            df = self.catalog.columns(self, name, self.database)
+            # Unknown tables are left to the server to report.
+            if df is not None:
+                return df
+        with self._connection() as con:
+            df = pd.read_sql_query(command, con)
         return df
 
     def insert_columns(self, to_table, from_table, cols=None, where=None, printable=False):
@@ -542,9 +3111,10 @@ class CZ:
         if printable or self.engine is None:
             return command
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
         except InternalError as err:
             return err
+        self._invalidate(to_table)
         return_string = ', '.join(cols)
         return f'column(s) {return_string} inserted into {to_table} from {from_table}.'
 
@@ -565,8 +3135,353 @@ class CZ:
         if printable or self.engine is None:
             return command
         try:
-            self.engine.connect().execute(command)
+            self._execute(command)
         except InternalError as err:
             return err
+        self._invalidate(table)
+        self._refresh_catalog(table)
         return_string = ', '.join(cols)
         return f'column(s) {return_string} deleted.'
+
+
+class AsyncCZ(CZ):
+    '''
+    AsyncCZ mirrors CZ on a SQLAlchemy AsyncEngine, such as one made with
+    create_async_engine('sqlite+aiosqlite:///file.db'), so that queries on
+    many databases can be awaited at the same time. Statements are built by
+    CZ's printable methods, and every method that talks to the database is a
+    coroutine. printable=True still returns the command, once awaited.
+    session, csvs_into_database, s3_insert and refresh_catalog need a sync
+    engine and raise NotImplementedError.
+        results = await acz.gather([acz.select_from('t1'), acz.select_from('t2')])
+    '''
+
+    class SQL(CZ.SQL):
+        '''
+        The SQL object of AsyncCZ, whose .ex() is awaited.
+        '''
+
+        async def ex(self, p=False):
+            if p or self.engine is None:
+                return self.command
+            import pandas as pd
+            statement, params = self._statement()
+            key = getattr(statement, 'text', statement)
+            if self.cache is not None:
+                df = self.cache.get(key, self.database, params)
+                if df is not None:
+                    return df
+            async with self.engine.connect() as con:
+                df = await con.run_sync(lambda c: pd.read_sql_query(statement, c, params=params))
+            if self.cache is not None:
+                self.cache.put(key, df, self.database, params)
+            return df
+
+        async def stream(self, chunksize=100000, tuples=False):
+            '''
+            Asynchronously yields the results chunksize rows at a time, as
+            DataFrames or lists of row tuples, from a server side cursor.
+            '''
+            import pandas as pd
+            from sqlalchemy import text
+            statement, params = self._statement()
+            if isinstance(statement, str):
+                statement = text(statement)
+            async with self.engine.connect() as con:
+                result = await con.stream(statement, params)
+                columns = list(result.keys())
+                async for rows in result.partitions(chunksize):
+                    rows = [tuple(row) for row in rows]
+                    yield rows if tuples else pd.DataFrame(rows, columns=columns)
+
+        async def explain(self, analyze=False):
+            statement, params, kind = self._explain(analyze)
+            async with self.engine.connect() as con:
+                rows = (await con.execute(statement, params)).fetchall()
+            return self._plan(rows, kind)
+
+        async def to_csv(self, path, chunksize=100000, **kwargs):
+            i = 0
+            async for df in self.stream(chunksize=chunksize):
+                df.to_csv(path, mode='a' if i else 'w', header=not i, index=False, **kwargs)
+                i += 1
+            return f'results written to {path}.'
+
+        async def to_parquet(self, path, chunksize=100000, **kwargs):
+            writer = None
+            try:
+                async for df in self.stream(chunksize=chunksize):
+                    writer = self._write_parquet(writer, df, path, **kwargs)
+            finally:
+                if writer is not None:
+                    writer.close()
+            return f'results written to {path}.'
+
+    async def gather(self, sqls, limit=10):
+        '''
+        Runs SQL objects, or any other awaitables such as AsyncCZ method
+        calls, concurrently and returns their results in order. At most
+        limit of them are in flight at once, so a pool or server isn't
+        flooded. The SQL objects may belong to different AsyncCZs.
+        params:
+            sqls        iterable of SQL objects and awaitables.
+            limit       the most statements allowed to run at once.
+        '''
+        import asyncio
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(sql):
+            async with semaphore:
+                if isinstance(sql, CZ.SQL):
+                    return await sql.ex()
+                return await sql
+
+        return await asyncio.gather(*(run(sql) for sql in sqls))
+
+    async def _execute(self, command, *multiparams):
+        from sqlalchemy import text
+        async with self.engine.begin() as con:
+            result = await con.execute(text(command), *multiparams)
+            if result.returns_rows:
+                return result.fetchall()
+            return result
+
+    async def _read(self, command):
+        import pandas as pd
+        async with self.engine.connect() as con:
+            return await con.run_sync(lambda c: pd.read_sql_query(command, c))
+
+    async def _has_table(self, table):
+        from sqlalchemy import inspect
+        async with self.engine.connect() as con:
+            return await con.run_sync(lambda c: inspect(c).has_table(table, schema=self.database))
+
+    async def show_tables(self, all=False, printable=False):
+        command = CZ.show_tables(self, all=all, printable=True)
+        if printable or self.engine is None:
+            return command
+        return await self._read(command)
+
+    async def show_columns(self, table, all=False, printable=False):
+        command = CZ.show_columns(self, table, all=all, printable=True)
+        if printable or self.engine is None:
+            return command
+        return await self._read(command)
+
+    async def clone_table(self, target, new_table=None, cols=None, where=None, printable=False):
+        from sqlalchemy.exc import InternalError
+        command = CZ.clone_table(self, target, new_table=new_table, cols=cols, where=where, printable=True)
+        if printable or self.engine is None:
+            return command
+        if new_table is None:
+            new_table = target + '_copy'
+        if self.database:
+            target = self.database + '.' + target
+        try:
+            await self._execute(command)
+        except InternalError as err:
+            return err
+        self._invalidate(new_table)
+        return f'table {target} cloned into table {new_table}.'
+
+    async def mk_db(self, db, charset='utf8', collate='utf8_general_ci', printable=False):
+        from sqlalchemy.exc import ProgrammingError
+        command = CZ.mk_db(self, db, charset=charset, collate=collate, printable=True)
+        if printable or self.engine is None:
+            return command
+        try:
+            await self._execute(command)
+            return f'database {db} created.'
+        except ProgrammingError as err:
+            return err
+
+    async def show_db(self, printable=False):
+        command = CZ.show_db(self, printable=True)
+        if printable or self.engine is None:
+            return command
+        return await self._read(command)
+
+    async def del_db(self, db, printable=False):
+        from sqlalchemy.exc import InternalError
+        command = CZ.del_db(self, db, printable=True)
+        if printable or self.engine is None:
+            return command
+        try:
+            await self._execute(command)
+            self._invalidate()
+            return f'database {db} deleted.'
+        except InternalError as err:
+            return err
+
+    async def current_db(self, printable=False):
+        command = CZ.current_db(self, printable=True)
+        if printable or self.engine is None:
+            return command
+        return (await self._execute(command))[0][0]
+
+    async def use_db(self, db=None, printable=False):
+        if db is None:
+            db = self.database
+        command = CZ.use_db(self, db, printable=True)
+        if printable or self.engine is None:
+            return command
+        await self._execute(command)
+        self._invalidate()
+        return f'database {db} selected.'
+
+    async def unuse_db(self, printable=False):
+        command = CZ.unuse_db(self, printable=True)
+        if printable or self.engine is None:
+            return command
+        await self._execute(command)
+        self._invalidate()
+        return 'database deselected.'
+
+    async def csv_table(self, file, table=None, pkey=None, nrows=100000, infer='head', clean_colnames=False, printable=False, **kwargs):
+        '''
+        Creates an empty table based on data from a file like
+        CZ.csv_table. The file is read in a thread so other coroutines
+        carry on meanwhile.
+        '''
+        import asyncio
+        from sqlalchemy.exc import InternalError
+        command = await asyncio.to_thread(
+            CZ.csv_table, self, file, table=table, pkey=pkey, nrows=nrows, infer=infer,
+            clean_colnames=clean_colnames, printable=True, **kwargs)
+        if printable or self.engine is None:
+            return command
+        if table is None:
+            table = self._file_stem(file)
+        if self.database:
+            table = self.database + '.' + table
+        try:
+            await self._execute(command)
+            return f'table {table} created.'
+        except InternalError as err:
+            return err
+
+    async def del_tables(self, tables, printable=False):
+        from sqlalchemy.exc import InternalError
+        if isinstance(tables, str):
+            tables = [tables]
+        command = CZ.del_tables(self, list(tables), printable=True)
+        if printable or self.engine is None:
+            return command
+        if self.database:
+            tables = [self.database + '.' + table for table in tables]
+        try:
+            await self._execute(command)
+        except InternalError as err:
+            return err
+        for table in tables:
+            self._invalidate(table)
+        return_string = ', '.join(tables)
+        return f'table(s) {return_string} deleted.'
+
+    async def insert_columns(self, to_table, from_table, cols=None, where=None, printable=False):
+        from sqlalchemy.exc import InternalError
+        command = CZ.insert_columns(self, to_table, from_table, cols=cols, where=where, printable=True)
+        if printable or self.engine is None:
+            return command
+        if self.database:
+            to_table = self.database + '.' + to_table
+        try:
+            await self._execute(command)
+        except InternalError as err:
+            return err
+        self._invalidate(to_table)
+        if cols is None:
+            cols = '*'
+        elif not isinstance(cols, str):
+            cols = ', '.join(cols)
+        return f'column(s) {cols} inserted into {to_table} from {from_table}.'
+
+    async def del_columns(self, table, cols, if_exists=True, printable=False):
+        from sqlalchemy.exc import InternalError
+        command = CZ.del_columns(self, table, cols, if_exists=if_exists, printable=True)
+        if printable or self.engine is None:
+            return command
+        if self.database:
+            table = self.database + '.' + table
+        if isinstance(cols, str):
+            cols = [cols]
+        try:
+            await self._execute(command)
+        except InternalError as err:
+            return err
+        self._invalidate(table)
+        return_string = ', '.join(cols)
+        return f'column(s) {return_string} deleted.'
+
+    # CZ methods that hold a sync connection or load through worker CZs
+    # have no async counterpart, and fail loudly rather than return an
+    # un-awaited coroutine's success message.
+    def _sync_only(self, name, instead):
+        raise NotImplementedError(f'{name} is not available on AsyncCZ. {instead}')
+
+    def session(self):
+        self._sync_only('session', 'Each AsyncCZ statement runs in its own transaction.')
+
+    def csvs_into_database(self, *args, **kwargs):
+        self._sync_only('csvs_into_database', 'Await csv_insert for each file, for instance through gather.')
+
+    def s3_insert(self, *args, **kwargs):
+        self._sync_only('s3_insert', 'Use CZ on a sync engine.')
+
+    def refresh_catalog(self, table=None):
+        self._sync_only('refresh_catalog', 'Use CZ on a sync engine.')
+
+    async def csv_insert(self, file, table=None, pkey=None, postgre=False, chunksize=None, sizelim=1073741824, batch_size=None, clean_colnames=False, printable=False, **kwargs):
+        '''
+        Uploads file data into a database like CZ.csv_insert. Chunks are
+        parsed in a thread so other coroutines carry on meanwhile, and the
+        file is committed as a whole. A new table is created from the first
+        chunk, with pkey as its PRIMARY KEY. If pkey is given, rows whose
+        primary key already exists are updated.
+        params:
+            file        path of file to be uploaded.
+            table       if None, table = filename.
+            pkey        the table's PRIMARY KEY.
+            postgre     set to True if working on a PostgreSQL database.
+            chunksize   the number of rows read and inserted at a time.
+            sizelim     the file size, in bytes, past which chunksize
+                        defaults to 100000.
+            batch_size  the number of rows bound into each executemany call
+                        when upserting.
+            clean_colnames  cleans the column names as they are read.
+            printable   returns the SQL commands as CZ.csv_insert does.
+            **kwargs    Other arguments to be passed on to pandas read_csv.
+        '''
+        import asyncio
+        from sqlalchemy import text
+        if printable or self.engine is None:
+            return CZ.csv_insert(self, file, table=table, pkey=pkey, postgre=postgre, chunksize=chunksize, sizelim=sizelim, clean_colnames=clean_colnames, printable=True, **kwargs)
+        if table is None:
+            table = self._file_stem(file)
+        if chunksize is None and self._data_size(file) >= sizelim:
+            chunksize = 100000
+        reader = self._read_chunks(file, chunksize=chunksize, clean_colnames=clean_colnames, **kwargs)
+        exists = await self._has_table(table)
+        name = self.database + '.' + table if self.database else table
+        if self.engine.dialect.name == 'mysql' and getattr(self, '_packet', None) is None:
+            # Read up front, as _max_packet can't query through the async
+            # engine from inside run_sync.
+            self._packet = int((await self._execute('SELECT @@max_allowed_packet;'))[0][0])
+
+        def insert(con, df):
+            if pkey:
+                self._batch_insert(df, name, pkey=pkey, postgre=postgre, batch_size=batch_size, con=con)
+            else:
+                df.to_sql(table, con, schema=self.database, index=False, if_exists='append')
+
+        async with self.engine.begin() as con:
+            while True:
+                df = await asyncio.to_thread(next, reader, None)
+                if df is None:
+                    break
+                if not exists:
+                    await con.execute(text(self._table_command(df, table, pkey=pkey)))
+                    exists = True
+                await con.run_sync(insert, df)
+        self._invalidate(table)
+        return f'data loaded into table {name}.'